@@ -1,10 +1,39 @@
 import pandas as pd
 import argparse
+import logging
 import configparser
-from packages import (snowflake_data_handler, snowflake_csv_saver, co_visitation, data_cleansing, repeatability,
-                      traffic_structure, demographic_structure, buildings_characteristics, residence_work)
-from fpdf import FPDF
 import os
+import re
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import redirect_stdout
+from io import StringIO
+from types import SimpleNamespace
+
+@functools.lru_cache(maxsize=None)
+def _image_size(img_path, mtime):
+    # PIL is only needed for PDF output; the header is read once per image version
+    from PIL import Image
+    with Image.open(img_path) as img:
+        return img.size
+
+def image_size(img_path):
+    """Return the (width, height) of an image, cached per path and modification time."""
+    return _image_size(img_path, os.path.getmtime(img_path))
+
+def fit_image(page_width, page_height, img_width, img_height, margin=20):
+    """
+    Scale an image to fit the page and center it.
+
+    Returns:
+    tuple: x, y, width and height of the image on the page.
+    """
+    # Use the smaller ratio to ensure the entire image fits within the page
+    scale_factor = min((page_width - margin) / img_width, (page_height - margin) / img_height)
+
+    new_width = img_width * scale_factor
+    new_height = img_height * scale_factor
+    return (page_width - new_width) / 2, (page_height - new_height) / 2, new_width, new_height
 
 def append_to_pdf(pdf, content):
     if isinstance(content, str):
@@ -15,29 +44,9 @@ def append_to_pdf(pdf, content):
     elif isinstance(content, dict) and 'path' in content and content['path'].lower().endswith('.jpg'):
         img_path = content['path']
 
-        # Calculate maximum image dimensions that fit the page
-        max_width = pdf.w - 20
-        max_height = pdf.h - 20  # Adjust as needed for margins
-
-        # Get image dimensions using PIL (Python Imaging Library)
-        from PIL import Image
-        img = Image.open(img_path)
-        img_width, img_height = img.size
-
-        # Calculate scaling factors to fit the image within page dimensions
-        width_ratio = max_width / img_width
-        height_ratio = max_height / img_height
-
-        # Use the smaller ratio to ensure the entire image fits within the page
-        scale_factor = min(width_ratio, height_ratio)
-
-        # Calculate resized dimensions
-        new_width = img_width * scale_factor
-        new_height = img_height * scale_factor
-
-        # Calculate position to center image
-        x = (pdf.w - new_width) / 2
-        y = (pdf.h - new_height) / 2
+        # Fit the image within the page margins, centered
+        img_width, img_height = image_size(img_path)
+        x, y, new_width, new_height = fit_image(pdf.w, pdf.h, img_width, img_height)
 
         # Add a new page if no page is open
         if pdf.page_no() == 0:
@@ -48,6 +57,9 @@ def append_to_pdf(pdf, content):
 
 
 def create_pdf(contents, output_file):
+    # fpdf is only needed with --pdf
+    from fpdf import FPDF
+
     pdf = FPDF()
     new_page_added = False  # Flag to track if a new page has been added
 
@@ -64,93 +76,539 @@ def create_pdf(contents, output_file):
 
 
 def load_config(config_file='config.ini'):
+    """
+    Load the analyzer configuration. The parsed result is cached until the file changes.
+
+    Parameters:
+    config_file (str): Path to the configuration file.
+
+    Returns:
+    SimpleNamespace: One attribute per section (paths_input, paths_output, jpg_output, analysis, io,
+                     columns, filters, steps).
+    """
+    return _load_config(config_file, os.path.getmtime(config_file))
+
+@functools.lru_cache(maxsize=4)
+def _load_config(config_file, mtime):
     config = configparser.ConfigParser()
     config.read(config_file)
 
-    # Extract paths from the config and return as a dictionary
-    paths_input = {key: value for key, value in config['paths_input'].items()}
-    paths_output = {key: value for key, value in config['paths_output'].items()}
-    jpg_output = {key: value for key, value in config['jpg_output'].items()}
-    analysis = {key: value for key, value in config['analysis'].items()}
+    # Extract paths from the config as dictionaries
+    paths_input = dict(config['paths_input'])
+    paths_output = dict(config['paths_output'])
+    jpg_output = dict(config['jpg_output'])
+    analysis = dict(config['analysis'])
+    io = {
+        "engine": config.get('io', 'engine', fallback='pandas'),
+        "parquet_cache": config.getboolean('io', 'parquet_cache', fallback=False),
+    }
+
+    # Optional column projection and Parquet predicate pushdown per table
+    columns = {}
+    if config.has_section('columns'):
+        columns = {key: [column.strip() for column in value.split(',') if column.strip()]
+                   for key, value in config['columns'].items() if value.strip()}
+    filters = {}
+    if config.has_section('filters'):
+        filters = {key: parse_filters(value) for key, value in config['filters'].items() if value.strip()}
+
+    # Analysis steps to run, in report order; all registered steps by default
+    steps = config.get('steps', 'run', fallback=','.join(STEP_REGISTRY))
+    steps = [step.strip() for step in steps.split(',') if step.strip()]
+
+    return SimpleNamespace(paths_input=paths_input, paths_output=paths_output, jpg_output=jpg_output,
+                           analysis=analysis, io=io, columns=columns, filters=filters, steps=steps)
+
+# A "column operator value" filter condition; spaces around the operator are optional
+FILTER_CONDITION = re.compile(r'\s*(\w+)\s*(==|!=|<=|>=|=|<|>)\s*([^\s=<>!].*?)\s*')
+
+def parse_filters(text):
+    """
+    Parse a filter expression such as "LATITUDE > 0; LONGITUDE != 0" into pyarrow filter tuples.
+
+    Parameters:
+    text (str): Semicolon separated "column operator value" conditions.
+
+    Returns:
+    list: List of (column, operator, value) tuples.
+    """
+    filters = []
+    for condition in text.split(';'):
+        if not condition.strip():
+            continue
+        match = FILTER_CONDITION.fullmatch(condition)
+        if match is None:
+            raise ValueError(f"Invalid filter condition {condition.strip()!r}, "
+                             f"expected 'column operator value', e.g. 'LATITUDE > 0'")
+        column, operator, value = match.groups()
+        value = value.strip('\'"')
+        for cast in (int, float):
+            try:
+                value = cast(value)
+                break
+            except ValueError:
+                pass
+        filters.append((column, operator, value))
+    return filters
+
+def read_csv(path, engine='pandas', columns=None):
+    """
+    Read a CSV file with the selected parser engine.
+
+    Parameters:
+    path (str): Path to the CSV file.
+    engine (str): 'pandas' (default), 'pyarrow' or 'polars' (optional dependency).
+    columns (list): Columns to read, all columns if None.
+
+    Returns:
+    DataFrame: Parsed CSV data.
+    """
+    if engine == 'pyarrow':
+        import pyarrow.csv
+
+        read_options = pyarrow.csv.ReadOptions(use_threads=True, block_size=64 << 20)
+        convert_options = pyarrow.csv.ConvertOptions(include_columns=columns)
+        # Parse straight from a memory map and let pandas take over the Arrow buffers column by
+        # column, so the file is never held twice in memory
+        with pyarrow.memory_map(path, 'r') as source:
+            table = pyarrow.csv.read_csv(source, read_options=read_options, convert_options=convert_options)
+        return table.to_pandas(types_mapper=pd.ArrowDtype, self_destruct=True, split_blocks=True)
+    elif engine == 'polars':
+        import polars as pl
+
+        return pl.read_csv(path, columns=columns, n_threads=os.cpu_count()).to_pandas()
+    else:
+        return pd.read_csv(path, usecols=columns)
+
+# Open Parquet files by path: (mtime, pyarrow.parquet.ParquetFile)
+_parquet_files = {}
 
-    return {"paths_input": paths_input, "paths_output": paths_output, "jpg_output": jpg_output, "analysis": analysis}
+def get_parquet_file(path):
+    """
+    Return an open pyarrow ParquetFile for path.
+
+    The handle, and with it the decoded footer metadata, is reused for as long as the file's
+    modification time is unchanged.
+    """
+    import pyarrow.parquet as pq
+
+    mtime = os.path.getmtime(path)
+    cached = _parquet_files.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, pq.ParquetFile(path))
+        _parquet_files[path] = cached
+    return cached[1]
+
+def read_parquet(path, columns=None, filters=None):
+    """
+    Read a Parquet file, optionally projecting columns and filtering rows.
+
+    Parameters:
+    path (str): Path to the Parquet file.
+    columns (list): Columns to read, all columns if None.
+    filters (list): Row filters as (column, operator, value) tuples.
+
+    Returns:
+    DataFrame: Loaded data.
+    """
+    if filters:
+        # Row-group pruning needs the dataset reader
+        return pd.read_parquet(path, engine='pyarrow', columns=columns, filters=filters)
+    table = get_parquet_file(path).read(columns=columns, use_pandas_metadata=True)
+    return table.to_pandas()
 
-def load_data(paths):
+def read_csv_cached(path, engine='pandas', columns=None):
+    """
+    Read a CSV file through a sibling Parquet copy (path + '.parquet').
+
+    The copy is (re)written whenever it is missing or older than the CSV file, so later runs
+    read Parquet instead of parsing the CSV again.
+
+    Parameters:
+    path (str): Path to the CSV file.
+    engine (str): CSV parser engine, see read_csv.
+    columns (list): Columns to read, all columns if None.
+
+    Returns:
+    DataFrame: Loaded data.
+    """
+    parquet_path = path + '.parquet'
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        if engine == 'pyarrow':
+            # Same Arrow-backed columns as a fresh read_csv with this engine
+            table = get_parquet_file(parquet_path).read(columns=columns, use_pandas_metadata=True)
+            return table.to_pandas(types_mapper=pd.ArrowDtype)
+        return read_parquet(parquet_path, columns)
+
+    # The cache holds every column so that a different projection can reuse it
+    data = read_csv(path, engine)
+    temporary_path = parquet_path + '.tmp'
+    try:
+        data.to_parquet(temporary_path, engine='pyarrow', compression='zstd', index=False)
+        os.replace(temporary_path, parquet_path)
+    except (OSError, TypeError, ValueError) as error:
+        print(f"Could not cache {path} as Parquet: {error}")
+
+    return data[columns] if columns else data
+
+def read_file(path, engine='pandas', columns=None, filters=None, parquet_cache=False):
+    """
+    Read a single CSV or Parquet file. Return an empty DataFrame if the file is missing; other read
+    errors are raised.
+
+    Parameters:
+    path (str): Path to the file.
+    engine (str): CSV parser engine, see read_csv.
+    columns (list): Columns to read, all columns if None.
+    filters (list): Parquet row filters as (column, operator, value) tuples; ignored for CSV.
+    parquet_cache (bool): Read CSV files through a sibling Parquet copy, see read_csv_cached.
+
+    Returns:
+    DataFrame: Loaded data.
+    """
+    if path.endswith('.csv'):
+        try:
+            if parquet_cache:
+                return read_csv_cached(path, engine, columns)
+            return read_csv(path, engine, columns)
+        except FileNotFoundError:
+            return pd.DataFrame()
+        except ValueError as error:
+            # Malformed input or a bad [columns] projection (pyarrow.lib.ArrowInvalid is a ValueError)
+            raise ValueError(f"Could not read {path}: {error}") from error
+    elif path.endswith('.parquet'):
+        try:
+            return read_parquet(path, columns, filters)
+        except FileNotFoundError:
+            return pd.DataFrame()
+    else:
+        return pd.DataFrame()  # Handle unknown file types gracefully
+
+def select_paths(paths, *keys):
+    """Return the subset of a paths dictionary with the given file names."""
+    return {key: paths[key] for key in keys}
+
+def load_data(paths, engine='pandas', columns=None, filters=None, parquet_cache=False):
     """
     Load data from CSV and Parquet files. Return empty DataFrames if files are missing.
 
+    Files are read concurrently; the CSV and Parquet readers release the GIL while decoding,
+    so the smaller tables load in the shadow of the traffic table.
+
     Parameters:
     paths (dict): Dictionary with file names as keys and file paths as values.
+    engine (str): CSV parser engine, see read_csv.
+    columns (dict): Optional file name -> list of columns to read.
+    filters (dict): Optional file name -> Parquet row filters.
+    parquet_cache (bool): Read CSV files through a sibling Parquet copy, see read_csv_cached.
 
     Returns:
     dict: Dictionary with file names as keys and DataFrames as values.
     """
-    data_frames = {}
+    columns = columns or {}
+    filters = filters or {}
 
-    for key, path in paths.items():
-        if path.endswith('.csv'):
-            try:
-                data_frames[key] = pd.read_csv(path)
-            except FileNotFoundError:
-                data_frames[key] = pd.DataFrame()
-        elif path.endswith('.parquet'):
-            try:
-                data_frames[key] = pd.read_parquet(path)
-            except FileNotFoundError:
-                data_frames[key] = pd.DataFrame()
-        else:
-            data_frames[key] = pd.DataFrame()  # Handle unknown file types gracefully
+    if not paths:
+        return {}
+
+    max_workers = min(len(paths), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {key: executor.submit(read_file, path, engine, columns.get(key), filters.get(key), parquet_cache)
+                   for key, path in paths.items()}
+        data_frames = {key: future.result() for key, future in futures.items()}
 
     return data_frames
 
+# Analysis packages pull in shapely, geopandas, matplotlib and the Snowflake client, so they are
+# imported only where they are used; --help and argument errors return without loading them.
+
 def download_csv(data_access, input):
+    from packages import snowflake_csv_saver
+
     snowflake_csv_saver.download_csv_files(data_access, input)
 
 def get_data_frames_from_snowflake(data_access):
+    from packages import snowflake_data_handler
+
     return snowflake_data_handler.sql_to_dataframes(data_access)
 
+# Analysis steps. Each step takes the analysis context (input frames, plot flag and config sections)
+# and returns the list of items it contributes to the PDF report.
+
+def co_visitation_step(context):
+    from packages import co_visitation
+
+    print("Movements between given locations:")
+    matrix_jpg = context.jpg_output['matrix']
+    matrix = co_visitation.create_matrix(
+        context.traffic,
+        context.locations_soa,
+        plot=context.plot,
+        output_file=matrix_jpg)
+    print(matrix)
+    return [{'path': matrix_jpg}]
+
+def repeatability_step(context):
+    from packages import repeatability
+
+    print("Repeatability of mobile signals:")
+    top10_visit_frequencies_jpg = context.jpg_output['top10_visit_frequencies']
+    repeat_visits_summary, visit_frequency_summary_df = repeatability.calculate_and_return_repeat_frequencies(
+        context.traffic,
+        context.locations_soa)
+    repeatability.generate_combined_top10_plot(repeat_visits_summary, visit_frequency_summary_df, top10_visit_frequencies_jpg)
+    print(visit_frequency_summary_df)
+    return [{'path': top10_visit_frequencies_jpg}]
+
+def traffic_structure_step(context):
+    from packages import traffic_structure
+
+    print("Hourly traffic structure:")
+    traffic_structure_output_file = context.jpg_output['traffic_structure']
+    traffic_structure.process_and_plot_traffic_data(
+        context.traffic,
+        context.locations,
+        plot=context.plot,
+        output_jpg=traffic_structure_output_file)
+    return [{'path': traffic_structure_output_file}]
+
+def demographic_structure_step(context):
+    from packages import demographic_structure
+
+    print("Show the demographic structure:")
+    demographic_structure_output_file = context.jpg_output['demographic_structure']
+    demographic_structure.analyze_and_plot_population_data(
+        context.population,
+        context.locations,
+        context.analysis['location_for_population_analysis'],
+        plot=context.plot,
+        output_file=demographic_structure_output_file,
+        location_index=context.locations_soa)
+
+    demographic_structure.analyze_and_plot_population_data(
+        context.population,
+        context.locations,
+        "Mordor na Domaniewskiej",
+        plot=context.plot,
+        output_file="demographic_structure_Domaniewska.jpg",
+        location_index=context.locations_soa)
+    return [{'path': demographic_structure_output_file}]
+
+def buildings_characteristics_step(context):
+    from packages import buildings_characteristics
+
+    print("Characteristics of buildings:")
+    buildings_analysis = context.jpg_output['buildings_analysis']
+    location_names = context.analysis['location_for_buildings_analysis'].split(',')
+    logging.debug("Locations for buildings analysis: %s", location_names)
+    location_codes = context.locations_soa.lookup_codes(location_names)
+    for location_name, location_code in zip(location_names, location_codes):
+        if location_code < 0:
+            print(f"Location '{location_name}' not found in locations data.")
+    buildings_characteristics.analyze_and_display_buildings(
+        context.buildings,
+        context.locations_soa,
+        location_codes[location_codes >= 0],
+        save_to_file=context.plot,
+        output_file=buildings_analysis,
+        building_geoms=buildings_characteristics.load_building_geoms(context.buildings, context.buildings_cache)
+    )
+    return [{'path': buildings_analysis}]
+
+def format_residence_work_report(work_location, commute_location, home_location, work_users, home_users):
+    """Build the residence and work report text from the estimated numbers of users."""
+    parts = [
+        "Estimating the likely place of residence and work\n",
+        f"\nEstimated number users commuting between {work_location} and {commute_location} and probably works in {work_location}:\n",
+        f"{work_users}\n",
+        f"\nEstimated number users commuting between {home_location} and {commute_location} and probably living in {home_location}:\n",
+        f"{home_users}\n",
+    ]
+    return ''.join(parts)
+
+def estimated_user_count(estimation):
+    """Number of users with an estimated location, 0 if no users commute between the locations."""
+    estimated_locations = estimation['estimated_locations']
+    return 0 if estimated_locations is None else len(estimated_locations)
+
+def residence_work_step(context):
+    from packages import residence_work
+
+    work_location = context.analysis['user_work_location']
+    commute_location = context.analysis['user_commute_location']
+    home_location = context.analysis['user_home_location']
+
+    # Both estimations only look at signals inside these locations, so filter the traffic once
+    traffic = residence_work.filter_traffic_to_locations(
+        context.traffic,
+        context.locations,
+        [commute_location, work_location, home_location],
+        location_index=context.locations_soa)
+
+    # Both estimations start from the commute location, so its signals are selected once
+    commute_signals = residence_work.location_signals(traffic, context.locations, commute_location,
+                                                      location_index=context.locations_soa)
+
+    work_estimation = residence_work.analyze_travel_and_users(
+        traffic,
+        context.locations,
+        commute_location,
+        work_location,
+        8, 18,
+        location_index=context.locations_soa,
+        location1_signals=commute_signals
+    )
+
+    residence_estimation = residence_work.analyze_travel_and_users(
+        traffic,
+        context.locations,
+        commute_location,
+        home_location,
+        22, 5,
+        location_index=context.locations_soa,
+        location1_signals=commute_signals
+    )
+
+    report = format_residence_work_report(work_location, commute_location, home_location,
+                                          estimated_user_count(work_estimation),
+                                          estimated_user_count(residence_estimation))
+    print(report)
+    return [report]
+
+# Analysis steps by name, as listed in the [steps] section of config.ini. Steps are independent
+# of each other and may run in parallel.
+STEP_REGISTRY = {
+    "co_visitation": co_visitation_step,
+    "repeatability": repeatability_step,
+    "traffic_structure": traffic_structure_step,
+    "demographic_structure": demographic_structure_step,
+    "buildings_characteristics": buildings_characteristics_step,
+    "residence_work": residence_work_step,
+}
+
+_worker_context = None
+
+def _init_step_worker(context):
+    # Runs once per worker process, so the input frames are transferred once per worker, not once per step
+    global _worker_context
+    _worker_context = context
+
+def _run_step_in_worker(step):
+    output = StringIO()
+    with redirect_stdout(output):
+        contents = step(_worker_context)
+    return contents, output.getvalue()
+
+def run_steps(steps, context, jobs=1):
+    """
+    Run analysis steps, sequentially or in a pool of worker processes.
+
+    Worker output is buffered and printed in step order, so the console log reads the same as a
+    sequential run.
+
+    Parameters:
+    steps (list): Step functions taking the analysis context.
+    context (SimpleNamespace): Analysis context passed to every step.
+    jobs (int): Number of worker processes; 1 runs the steps in this process, 0 or less uses one
+                process per CPU.
+
+    Yields:
+    list: The PDF contents returned by each step, in step order, as soon as the step has finished.
+    """
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    if jobs == 1 or len(steps) <= 1:
+        for step in steps:
+            yield step(context)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(steps)), initializer=_init_step_worker,
+                             initargs=(context,)) as executor:
+        futures = [executor.submit(_run_step_in_worker, step) for step in steps]
+        for future in futures:
+            contents, output = future.result()
+            print(output, end='')
+            yield contents
+
 def main():
     parser = argparse.ArgumentParser(description="Data Analyzer")
     parser.add_argument("-d", "--download", action="store_true", help="Download CSV files")
     parser.add_argument("-c", "--connection", action="store_true", help="Use database connection")
     parser.add_argument("-p", "--plot", action="store_true", help="Generate and save plot as JPG")
     parser.add_argument("--pdf", action="store_true", help="Save analysis to PDF")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print diagnostic output")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes for the analysis steps, 0 for one per CPU")
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format="%(message)s")
+
     if args.pdf:
         args.plot=True
 
     PATHS = load_config("config.ini")
+    unknown_steps = [step for step in PATHS.steps if step not in STEP_REGISTRY]
+    if unknown_steps:
+        parser.error(f"Unknown analysis steps in config.ini: {', '.join(unknown_steps)}")
+    engine = PATHS.io["engine"]
+    columns = PATHS.columns
+    filters = PATHS.filters
+    parquet_cache = PATHS.io["parquet_cache"]
 
     if args.download or args.connection:
-        for path in (PATHS["paths_input"], PATHS["paths_output"], PATHS["jpg_output"]):
+        from packages import data_cleansing
+
+        for path in (PATHS.paths_input, PATHS.paths_output, PATHS.jpg_output):
             os.makedirs(path['core'], exist_ok=True)
 
-        locations = load_data(PATHS["paths_input"])["locations"]
-        locations = data_cleansing.clean_locations(locations)
-        data_cleansing.save_data(locations, PATHS["paths_output"]["locations"])
+        locations = load_data(select_paths(PATHS.paths_input, "locations"), engine, columns, filters,
+                              parquet_cache)["locations"]
     else:
-        locations = load_data(PATHS["paths_output"])["locations"]
-
+        # Cleaned files are loaded once here and reused below, smallest and most likely to be missing first
+        data_frames = load_data(select_paths(PATHS.paths_output, "locations"), engine, columns, filters, parquet_cache)
+        locations = data_frames["locations"]
 
+    # Checked before cleaning, which needs the location columns
+    if locations.empty:
+        print("Locations data is empty. Please check your data files.")
+        return
 
+    if args.download or args.connection:
+        locations = data_cleansing.clean_locations(locations, cache_dir=PATHS.paths_output["locations"] + ".cache")
+        data_cleansing.save_data(locations, PATHS.paths_output["locations"])
+
+    if not (args.download or args.connection):
+        data_frames.update(load_data(select_paths(PATHS.paths_output, "traffic"), engine, columns, filters,
+                                     parquet_cache))
+        if data_frames["traffic"].empty:
+            print("Traffic data is empty. Please check your data files.")
+            return
+        data_frames.update(load_data(select_paths(PATHS.paths_output, "population", "buildings"), engine, columns,
+                                     filters, parquet_cache))
 
     if args.download:
         print("Downloading CSV files...")
         download_csv('data_access/dataplace.ini', "input")
-        data_frames = load_data(PATHS["paths_input"])
+        data_frames = load_data(select_paths(PATHS.paths_input, "population", "buildings"), engine, columns, filters,
+                                parquet_cache)
         # Clean the traffic data
-        traffic = data_frames["traffic"]
-        traffic = data_cleansing.clean_traffic_data(traffic)
-        data_cleansing.save_data(traffic, PATHS["paths_output"]["traffic"])
+        if filters.get("traffic"):
+            traffic = load_data(select_paths(PATHS.paths_input, "traffic"), engine, columns, filters,
+                                parquet_cache)["traffic"]
+            traffic = data_cleansing.clean_traffic_data(traffic)
+        else:
+            # Stream the largest table and clean it batch by batch to keep the memory peak low
+            traffic = data_cleansing.clean_traffic_data_chunked(data_cleansing.load_data_iter(
+                PATHS.paths_input["traffic"], batch_size=65_536, columns=columns.get("traffic"), engine=engine,
+                column_types=data_cleansing.TRAFFIC_CSV_TYPES))
+        data_cleansing.save_data(traffic, PATHS.paths_output["traffic"])
         # Clean the population data
         population = data_frames["population"]
         population = data_cleansing.clean_population_data(population)
-        data_cleansing.save_data(population, PATHS["paths_output"]["population"])
+        data_cleansing.save_data(population, PATHS.paths_output["population"])
         # Clean the buildings data
         buildings = data_frames["buildings"]
         buildings = data_cleansing.clean_bud_data(buildings)
-        data_cleansing.save_data(buildings, PATHS["paths_output"]["buildings"])
+        data_cleansing.save_data(buildings, PATHS.paths_output["buildings"])
 
 
     if args.connection:
@@ -165,114 +623,47 @@ def main():
         # Clean the buildings data
         buildings = dataframes["DATAPLACE_BUDB"]
         buildings = data_cleansing.clean_bud_data(buildings)
-    else:
+    elif not args.download:
+        # Freshly downloaded data is already in memory, otherwise reuse the frames loaded above
         print("Processing data from files...")
-        data_frames = load_data(PATHS["paths_output"])
         traffic = data_frames['traffic']
         population = data_frames["population"]
         buildings = data_frames["buildings"]
+        from packages import data_cleansing
 
-    # Defining variables
-    traffic_structure_output_file = PATHS['jpg_output']['traffic_structure']
-    demographic_structure_output_file = PATHS['jpg_output']['demographic_structure']
-    location_for_population_analysis = PATHS['analysis']['location_for_population_analysis']
-    buildings_analysis = PATHS['jpg_output']['buildings_analysis']
-    matrix_jpg = PATHS['jpg_output']['matrix']
-    top10_visit_frequencies_jpg = PATHS['jpg_output']['top10_visit_frequencies']
-    work_location = PATHS['analysis']['user_work_location']
-    commute_location = PATHS['analysis']['user_commute_location']
-    home_location = PATHS['analysis']['user_home_location']
-
-    content_for_pdg = []
+        # CSV files do not keep the compact column types of the cleansing
+        if not buildings.empty:
+            buildings = data_cleansing.downcast_bud_data(buildings)
+
+    if not traffic.empty:
+        # Coordinates are saved as float64 and only narrowed in memory for the analyses
+        traffic = data_cleansing.downcast_traffic_data(traffic)
+
+    context = SimpleNamespace(traffic=traffic, locations=locations, population=population, buildings=buildings,
+                              plot=args.plot, jpg_output=PATHS.jpg_output, analysis=PATHS.analysis,
+                              buildings_cache=PATHS.paths_output["buildings"] + ".cache")
+
+    content_for_pdg = iter(())
     ## Ensure dataframes are not empty before proceeding
     if not traffic.empty and not locations.empty and not buildings.empty and not population.empty:
+        from packages import locations_soa
+
+        # Parse location geometries once for the analyses that loop over all locations
+        context.locations_soa = locations_soa.from_dataframe(locations)
 
         print("Creating an analysis of:")
-        print("Movements between given locations:")
-        matrix = co_visitation.create_matrix(
-            traffic,
-            locations,
-            plot=args.plot,
-            output_file=matrix_jpg)
-        print(matrix)
-        content_for_pdg.append({'path': matrix_jpg})
-
-        print("Repeatability of mobile signals:")
-        repeat_visits_summary, visit_frequency_summary_df  = repeatability.calculate_and_return_repeat_frequencies(
-            traffic,
-            locations)
-        repeatability.generate_combined_top10_plot(repeat_visits_summary, visit_frequency_summary_df, top10_visit_frequencies_jpg)
-        content_for_pdg.append({'path': top10_visit_frequencies_jpg})
-        print(visit_frequency_summary_df)
-
-        print("Hourly traffic structure:")
-        traffic_structure.process_and_plot_traffic_data(
-            traffic,
-            locations,
-            plot=args.plot,
-            output_jpg=traffic_structure_output_file)
-        content_for_pdg.append({'path': traffic_structure_output_file})
-
-        print("Show the demographic structure:")
-        demographic_structure.analyze_and_plot_population_data(
-            population,
-            locations,
-            location_for_population_analysis,
-            plot=args.plot,
-            output_file=demographic_structure_output_file)
-        content_for_pdg.append({'path': demographic_structure_output_file})
-
-        demographic_structure.analyze_and_plot_population_data(
-            population,
-            locations,
-            "Mordor na Domaniewskiej",
-            plot=args.plot,
-            output_file="demographic_structure_Domaniewska.jpg")
-
-        print("Characteristics of buildings:")
-        location_names = PATHS['analysis']['location_for_buildings_analysis'].split(',')
-        print(location_names)
-        print(content_for_pdg[-1])
-        buildings_characteristics.analyze_and_display_buildings(
-            buildings,
-            locations,
-            location_names,
-            save_to_file=args.plot,
-            output_file=buildings_analysis
-        )
-
-        content_for_pdg.append({'path': buildings_analysis})
-
-        # Estimating the likely place of residence and work
-        content_for_pdg.append(f"Estimating the likely place of residence and work\n")
-
-        work_estimation = residence_work.analyze_travel_and_users(
-            traffic,
-            locations,
-            commute_location,
-            work_location,
-            8, 18
-        )
-
-        content_for_pdg[-1] = content_for_pdg[-1] + f"\nEstimated number users commuting between {work_location} and {commute_location} and probably works in {work_location}:\n"
-        content_for_pdg[-1] = content_for_pdg[-1] + str(len(work_estimation['estimated_locations'])) + f'\n'
-
-        residence_estimation = residence_work.analyze_travel_and_users(
-            traffic,
-            locations,
-            commute_location,
-            home_location,
-            22, 5
-        )
-
-        content_for_pdg[-1] = content_for_pdg[-1] + f"\nEstimated number users commuting between {home_location} and {commute_location} and probably living in {home_location}:\n"
-        content_for_pdg[-1] = content_for_pdg[-1] + str(len(residence_estimation['estimated_locations'])) + f'\n'
-        print(content_for_pdg[-1])
+        steps = [STEP_REGISTRY[step] for step in PATHS.steps]
+        # Items are produced as the steps finish and handed straight to the PDF
+        content_for_pdg = (content for contents in run_steps(steps, context, args.jobs) for content in contents)
     else:
         print("One or more required dataframes are empty. Please check your data files.")
 
     if args.pdf:
         create_pdf(content_for_pdg, 'analysis.pdf')
+    else:
+        # Without a PDF the steps still have to run
+        for _ in content_for_pdg:
+            pass
 
 if __name__ == "__main__":
     main()
@@ -1,31 +1,72 @@
 import pandas as pd
-import pygeos
+import numpy as np
+import shapely
+import matplotlib
+matplotlib.use('Agg')  # Plots are only written to files, no GUI backend is needed
 import matplotlib.pyplot as plt
-import seaborn as sns
 import re
-
-def analyze_and_display_buildings(building_data, locations, selected_locations, save_to_file=False, output_file=""):
+import logging
+import os
+from packages import locations_soa
+from packages.data_cleansing import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Word boundaries inside CamelCase text, see camelcase_to_words
+_LOWER_UPPER = re.compile(r'([a-z])([A-Z])')
+_UPPER_WORD = re.compile(r'([A-Z])([A-Z][a-z])')
+_UPPER_UPPER = re.compile(r'([A-Z])([A-Z])')
+
+def analyze_and_display_buildings(building_data, locations, location_codes, save_to_file=False, output_file="",
+                                  building_geoms=None):
+    """
+    Analyze buildings in the selected locations and optionally save a combined plot.
+
+    Parameters:
+    building_data (DataFrame): Buildings with WKB 'GEOMETRY'.
+    locations (DataFrame or LocationsSoA): Location data with geometry.
+    location_codes (array-like): int codes of the selected locations, see LocationsSoA.lookup_codes.
+    save_to_file (bool): Save the combined plot to output_file.
+    output_file (str): Path of the plot.
+    building_geoms (ndarray): Optional parsed building geometries, see load_building_geoms.
+
+    Returns:
+    dict: Location name -> (buildings in location, number of buildings, number of buildings per type).
+    """
+    locations = locations_soa.from_dataframe(locations)
+    location_codes = np.asarray(location_codes, dtype=np.int32)
+
+    # Parse building geometries and index them once for all selected locations
+    tree = build_buildings_tree(building_data, building_geoms)
+    known = np.isin(location_codes, locations.codes)
     analysis_results = {}
 
-    for location_name in selected_locations:
-        if location_name in locations['location'].values:
-            buildings_in_location = analyze_buildings_in_location(building_data, locations, location_name)
-            analysis_results[location_name] = (buildings_in_location, buildings_in_location.shape[0])
+    for location_code in location_codes[~known]:
+        print(f"Location code {location_code} not found in locations data.")
+
+    # One tree traversal for all selected locations
+    selected_codes = location_codes[known]
+    buildings_per_location = filter_buildings_by_locations(building_data, locations.geoms[selected_codes], tree)
+
+    for location_code, buildings_in_location in zip(selected_codes, buildings_per_location):
+        location_name = locations.names[location_code]
+        building_counts = describe_buildings(buildings_in_location, location_name)
+        analysis_results[location_name] = (buildings_in_location, buildings_in_location.shape[0], building_counts)
 
-            print(f"\nAnalysis Result for {location_name}:")
-            print(buildings_in_location)
-        else:
-            print(f"Location '{location_name}' not found in locations data.")
+        # The DataFrame is only formatted when debug logging is enabled
+        logger.debug("Analysis Result for %s:\n%s", location_name, buildings_in_location)
 
     if save_to_file:
         merge_and_save_plots(analysis_results, output_file)
 
     return analysis_results
 
-def analyze_buildings_in_location(building_data, locations, location_name):
-    buildings_in_location = filter_buildings_by_location(building_data, locations, location_name)
+def describe_buildings(buildings_in_location, location_name):
+    """Print a summary of the buildings in a location and return the number of buildings per type."""
     average_area = buildings_in_location['AREA'].mean()
     building_counts = buildings_in_location['FUNOGOLNABUDYNKU_DESC'].value_counts()
+    # Categorical columns also count the types absent from this location
+    building_counts = building_counts[building_counts > 0]
     average_floors = buildings_in_location['LICZBAKONDYGNACJI'].mean()
 
     print(f"\nBuilding Analysis for {location_name}:")
@@ -34,32 +75,97 @@ def analyze_buildings_in_location(building_data, locations, location_name):
     print(building_counts)
     print(f"Average Number of Floors: {average_floors:.2f}")
 
-    return buildings_in_location
-
-def filter_buildings_by_location(building_data, locations, location_name):
-    # Select location geometry for the specified location
-    location_geometry_bytes = locations.loc[locations['location'] == location_name, 'geometry'].values[0]
-
-    # Convert binary geometry to a PyGEOS geometry
-    location_geometry = pygeos.Geometry(location_geometry_bytes)
-
-    # Filter building data based on whether each building is within the location shape
-    def is_within_location(row):
-        building_geometry = pygeos.Geometry(row['GEOMETRY'])
-        return pygeos.intersects(building_geometry, location_geometry)
-
-    buildings_in_location = building_data[building_data.apply(is_within_location, axis=1)]
-
-    return buildings_in_location
-
-def save_analysis_plot(ax, buildings_in_location, location_name, total_buildings):
+    return building_counts
+
+def parse_building_geometries(values):
+    """
+    Parse building geometries into a Shapely geometry array.
+
+    Text values are read as WKT, binary values as WKB, and geometries are kept as they are.
+    """
+    values = np.asarray(values, dtype=object)
+    if len(values) == 0 or shapely.is_geometry(values).all():
+        return values
+
+    # A column read from a file holds one kind of value, so only mixed columns are checked per row
+    if isinstance(values[0], str) and isinstance(values[-1], str):
+        return shapely.from_wkt(values)
+    if isinstance(values[0], bytes) and isinstance(values[-1], bytes):
+        return shapely.from_wkb(values)
+
+    is_text = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+
+    geometries = np.empty(len(values), dtype=object)
+    geometries[is_text] = shapely.from_wkt(values[is_text])
+    geometries[~is_text] = shapely.from_wkb(values[~is_text])
+    return geometries
+
+def load_building_geoms(building_data, cache_dir=None):
+    """
+    Parse building geometries, reusing a copy cached in cache_dir while the GEOMETRY column is unchanged.
+
+    The cache file is keyed by a hash of the GEOMETRY column and stores the geometries as binary WKB
+    in a Parquet file, so warm runs only decode WKB instead of parsing text geometries.
+
+    Parameters:
+    building_data (DataFrame): Buildings with a 'GEOMETRY' column.
+    cache_dir (str): Directory of the cache files; without it the geometries are always parsed.
+
+    Returns:
+    ndarray: Shapely geometries, one per row of building_data.
+    """
+    if cache_dir is None:
+        return parse_building_geometries(building_data['GEOMETRY'].to_numpy())
+
+    cache_path = os.path.join(cache_dir, f"building_geoms-{content_hash(building_data[['GEOMETRY']])}.parquet")
+    if os.path.exists(cache_path):
+        return shapely.from_wkb(pd.read_parquet(cache_path)['WKB'].to_numpy(dtype=object))
+
+    geometries = parse_building_geometries(building_data['GEOMETRY'].to_numpy())
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary_path = cache_path + '.tmp'
+    pd.DataFrame({'WKB': shapely.to_wkb(geometries)}).to_parquet(temporary_path, index=False)
+    os.replace(temporary_path, cache_path)
+    return geometries
+
+def build_buildings_tree(building_data, building_geoms=None):
+    """
+    Build an STRtree over the building geometries; tree positions match the rows of building_data.
+    """
+    if building_geoms is None:
+        building_geoms = parse_building_geometries(building_data['GEOMETRY'].to_numpy())
+    return shapely.STRtree(building_geoms)
+
+def filter_buildings_by_locations(building_data, location_geometries, tree=None):
+    """
+    Select the buildings intersecting each of several locations with a single bulk tree query.
+
+    Parameters:
+    building_data (DataFrame): Buildings with a 'GEOMETRY' column.
+    location_geometries (ndarray): Shapely geometries of the locations.
+    tree (STRtree): Optional tree over the buildings, see build_buildings_tree.
+
+    Returns:
+    list: One DataFrame of buildings per location, rows in input order.
+    """
+    if tree is None:
+        tree = build_buildings_tree(building_data)
+
+    # (location index, building position) pairs, sorted by location index
+    location_indices, building_positions = tree.query(location_geometries, predicate='intersects')
+    boundaries = np.searchsorted(location_indices, np.arange(len(location_geometries) + 1))
+
+    return [building_data.iloc[np.sort(building_positions[start:end])]
+            for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+def camelcase_to_words(text):
     # Convert CamelCase to words with spaces before capital letters
-    def camelcase_to_words(text):
-        text = re.sub(r'([a-z])([A-Z])', r'\1 \2', text)
-        text = re.sub(r'([A-Z])([A-Z][a-z])', r'\1 \2', text)
-        text = re.sub(r'([A-Z])([A-Z])', r'\1 \2', text)
-        return text.lower()
+    text = _LOWER_UPPER.sub(r'\1 \2', text)
+    text = _UPPER_WORD.sub(r'\1 \2', text)
+    text = _UPPER_UPPER.sub(r'\1 \2', text)
+    return text.lower()
 
+def save_analysis_plot(ax, buildings_in_location, location_name, total_buildings):
     ax.set_title(f"Building Types Distribution in {location_name} (Total: {total_buildings} buildings)")
     ax.set_xlabel("")
     ax.set_ylabel("Building Type")
@@ -72,26 +178,30 @@ def save_analysis_plot(ax, buildings_in_location, location_name, total_buildings
 def merge_and_save_plots(locations_analysis_results, output_file=""):
     fig, axs = plt.subplots(len(locations_analysis_results), figsize=(12, 8))
 
-    for i, (location_name, (buildings_in_location, total_buildings)) in enumerate(locations_analysis_results.items()):
+    for i, (location_name, (buildings_in_location, total_buildings, building_counts)) in enumerate(locations_analysis_results.items()):
         ax = axs[i] if len(locations_analysis_results) > 1 else axs
-        sns.countplot(y='FUNOGOLNABUDYNKU_DESC', data=buildings_in_location,
-                      order=buildings_in_location['FUNOGOLNABUDYNKU_DESC'].value_counts().index, ax=ax)
+        # Reuse the counts from the summary; reversed so the most common type is drawn on top
+        ax.barh(building_counts.index[::-1], building_counts.values[::-1])
         save_analysis_plot(ax, buildings_in_location, location_name, total_buildings)
 
-    plt.tight_layout()
+    fig.tight_layout()
 
     # Prepare filename without Polish characters and spaces replaced by underscores
     filename = output_file
-    plt.savefig(filename)
+    fig.savefig(filename, dpi=100, bbox_inches='tight')
     print(f"Saved combined analysis plot as {filename}")
-    plt.close()
+    fig.clear()
+    plt.close(fig)
 
 if __name__ == "__main__":
     building_data = pd.read_csv('building_data.csv')
     locations = pd.read_parquet('locations.parquet')
 
+    locations = locations_soa.from_dataframe(locations)
+
     # List of selected locations for analysis
     selected_locations = ["Mordor na Domaniewskiej", "Osiedle Wilanów"]
+    location_codes = locations.lookup_codes(selected_locations)
 
     # Analyze and display results for selected locations with the option to save to file
-    analyze_and_display_buildings(building_data, locations, selected_locations, save_to_file=True, prefix="analysis_")
+    analyze_and_display_buildings(building_data, locations, location_codes, save_to_file=True, output_file="analysis.jpg")
@@ -1,85 +1,139 @@
 import pandas as pd
-from shapely.geometry import Point
-from shapely import wkb
-import shapely
+import numpy as np
+from scipy import sparse
 import matplotlib.pyplot as plt
+import seaborn as sns
+from packages import locations_soa
 
-def preprocess_data(traffic, locations):
+def preprocess_locations(locations):
     """
-    Preprocess the data: convert column labels and handle geometries.
+    Parse location geometries into a column-wise LocationsSoA (no-op if already one).
     """
-    traffic.columns = traffic.columns.str.lower()
-    locations.columns = locations.columns.str.upper()
-    locations = locations.dropna(subset=['GEOMETRY'])
-
-    def wkb_to_geometry(wkb_bytes):
-        try:
-            return wkb.loads(wkb_bytes, hex=True)
-        except shapely.errors.GEOSException:
-            return None
+    return locations_soa.from_dataframe(locations)
+
+def location_hits(traffic, locations):
+    """
+    Find the signals inside each location, as a long-form list of (signal, location) hits.
 
-    locations['GEOMETRY'] = locations['GEOMETRY'].apply(wkb_to_geometry)
-    locations = locations.dropna(subset=['GEOMETRY'])
+    Parameters:
+    traffic (DataFrame): Traffic data with 'longitude' and 'latitude' columns.
+    locations (LocationsSoA): Preprocessed locations.
+
+    Returns:
+    ndarray, ndarray: Signal position and location code of each hit.
+    """
+    # One STRtree query over all locations instead of testing every signal against every location
+    return locations.locate_points(traffic['longitude'].to_numpy(), traffic['latitude'].to_numpy())
 
-    return traffic, locations
+def signal_totals(traffic):
+    """
+    Sum the numeric columns of each signal other than 'user_id'.
+    """
+    numeric = traffic.drop(columns='user_id').select_dtypes(include=['number', 'bool'])
+    return numeric.sum(axis=1).to_numpy(dtype=np.float64)
 
-def is_in_location(row, location):
+def accumulate_user_visits(user_ids, signal_positions, location_codes, location_names, totals):
     """
-    Check if a user is in a specified location.
+    Count location hits per user with an indexed accumulator instead of a pandas groupby.
+
+    Parameters:
+    user_ids (Series): User id of each signal.
+    signal_positions (ndarray): Signal position of each hit, see location_hits.
+    location_codes (ndarray): Location code of each hit.
+    location_names (list): Location names, indexed by location code.
+    totals (ndarray): Numeric total of each signal, see signal_totals.
+
+    Returns:
+    DataFrame: Users as index, locations as columns and signal counts as values, plus a
+               'total_visits' column with the users' summed signal totals.
     """
-    point = Point(row['longitude'], row['latitude'])
-    return point.within(location.GEOMETRY)
+    user_codes, users = pd.factorize(user_ids)
+    hit_users = user_codes[signal_positions]
+    known = hit_users >= 0  # factorize marks missing user ids with -1
+
+    counts = np.zeros((len(users), len(location_names)), dtype=np.int64)
+    np.add.at(counts, (hit_users[known], location_codes[known]), 1)
 
-def add_location_columns(traffic, locations):
+    visit_counts = pd.DataFrame(counts, index=users, columns=location_names)
+    signals = user_codes >= 0
+    visit_counts['total_visits'] = np.bincount(user_codes[signals], weights=totals[signals], minlength=len(users))
+    return visit_counts
+
+def count_user_visits(traffic, locations):
     """
-    Add a column with the location name for each signal record.
+    Count the signals of each user in each location.
+
+    Parameters:
+    traffic (DataFrame or iterable of DataFrames): Traffic data, either whole or in chunks.
+    locations (LocationsSoA): Preprocessed locations.
+
+    Returns:
+    DataFrame: Users as index, locations as columns and signal counts as values, plus
+               'total_visits' (see accumulate_user_visits), or None if the traffic data has
+               no 'user_id' column.
     """
-    for location in locations.itertuples():
-        traffic[location.LOCATION] = traffic.apply(is_in_location, axis=1, args=(location,))
-    return traffic
+    chunks = [traffic] if isinstance(traffic, pd.DataFrame) else traffic
+    location_names = list(locations.names)
+    visit_counts = None
+
+    # Reduce chunk by chunk so that only one chunk of signals is held in memory at a time
+    for chunk in chunks:
+        chunk.columns = chunk.columns.str.lower()
+        if 'user_id' not in chunk.columns:
+            print("The 'user_id' column does not exist in the 'traffic' data")
+            return None
+
+        # Hits are kept as (signal, location) pairs instead of one boolean column per location
+        signal_positions, location_codes = location_hits(chunk, locations)
+        chunk_counts = accumulate_user_visits(chunk['user_id'], signal_positions, location_codes, location_names,
+                                              signal_totals(chunk))
+        visit_counts = chunk_counts if visit_counts is None else visit_counts.add(chunk_counts, fill_value=0)
 
-def calculate_co_visitation(traffic, locations):
+    return visit_counts
+
+def calculate_co_visitation(visit_counts, locations):
     """
     Calculate and return the co-visitation matrix.
     """
-    if 'user_id' in traffic.columns:
-        visit_counts = traffic.groupby('user_id').sum()
-        visit_counts_numeric = visit_counts.select_dtypes(include='number')
-        visit_counts_numeric = visit_counts_numeric.fillna(0)
-        visit_counts['total_visits'] = visit_counts_numeric.sum(axis=1)
-        co_visits = visit_counts[visit_counts['total_visits'] > 1]
-
-        co_visit_matrix = pd.DataFrame(index=locations['LOCATION'], columns=locations['LOCATION'])
-
-        for loc1 in locations['LOCATION']:
-            for loc2 in locations['LOCATION']:
-                if loc1 != loc2:
-                    co_visit_matrix.loc[loc1, loc2] = co_visits[(co_visits[loc1] > 0) & (co_visits[loc2] > 0)].shape[0]
-                else:
-                    co_visit_matrix.loc[loc1, loc2] = co_visits[co_visits[loc1] > 0].shape[0]
-
-        return co_visit_matrix.astype(float)  # Ensure all data is numeric
-    else:
-        print("The 'user_id' column does not exist in the 'traffic' data")
+    # One pass over the (users x locations) counts. As before, a user's total sums the location hits
+    # together with every other numeric traffic column (coordinates included), and only users with
+    # a total above one are kept.
+    counts = np.nan_to_num(visit_counts[list(locations.names)].to_numpy(dtype=np.float64))
+    totals = counts.sum(axis=1) + np.nan_to_num(visit_counts['total_visits'].to_numpy(dtype=np.float64))
+    co_visits = counts[totals > 1]
+
+    # co_visit_matrix[i, j] is the number of users seen in both locations i and j, i.e. B.T @ B for the
+    # (users x locations) visited matrix B; the diagonal counts the users of each location.
+    # Most users visit few locations, so B is stored sparse and only its non-zeros are multiplied.
+    user_codes, location_codes = np.nonzero(co_visits > 0)
+    visited = sparse.csr_matrix((np.ones(len(user_codes)), (user_codes, location_codes)),
+                                shape=co_visits.shape)
+    co_visit_matrix = (visited.T @ visited).toarray()
+
+    return pd.DataFrame(co_visit_matrix, index=locations.names, columns=locations.names)
 
 def create_matrix(traffic, locations, plot=False, output_file='co_visitation_matrix.jpg', title='Movements between given locations'):
-    traffic, locations = preprocess_data(traffic, locations)
-    traffic = add_location_columns(traffic, locations)
-    co_visit_matrix = calculate_co_visitation(traffic, locations)
+    """
+    Create the co-visitation matrix and optionally plot it.
+
+    Parameters:
+    traffic (DataFrame or iterable of DataFrames): Traffic data, e.g. chunks from data_cleansing.load_data_iter.
+    locations (DataFrame or LocationsSoA): Location data with geometry.
+    """
+    locations = preprocess_locations(locations)
+    visit_counts = count_user_visits(traffic, locations)
+    if visit_counts is None:
+        return None
+    co_visit_matrix = calculate_co_visitation(visit_counts, locations)
 
     if plot:
         # Plotting the co-visitation matrix
         plt.figure(figsize=(10, 8))
-        plt.imshow(co_visit_matrix.values, cmap='Blues', interpolation='nearest')
-        plt.title(title)
-        plt.colorbar()
-        plt.xticks(range(len(co_visit_matrix)), co_visit_matrix.columns, rotation=45)
-        plt.yticks(range(len(co_visit_matrix)), co_visit_matrix.index)
-
-        # Add text annotations for travel values in the center of each cell
-        for i in range(len(co_visit_matrix)):
-            for j in range(len(co_visit_matrix)):
-                plt.text(j, i, f'{co_visit_matrix.iloc[i, j]:.0f}', ha='center', va='center', color='black')
+        # The heatmap annotates every cell with its travel value in a single call
+        ax = sns.heatmap(co_visit_matrix, cmap='Blues', annot=True, fmt='.0f', cbar=True)
+        ax.set_title(title)
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.tick_params(axis='y', labelrotation=0)
 
         plt.tight_layout()
 
@@ -93,8 +147,10 @@ def create_matrix(traffic, locations, plot=False, output_file='co_visitation_mat
         print(co_visit_matrix)
 
 if __name__ == "__main__":
+    from packages.data_cleansing import load_data_iter
+
     traffic_path = 'traffic.csv'
-    traffic = pd.read_csv(traffic_path)
+    traffic = load_data_iter(traffic_path)
     locations_path = 'locations.parquet'
     locations = pd.read_parquet(locations_path)
     create_matrix(traffic, locations, plot=True)
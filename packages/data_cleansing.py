@@ -1,7 +1,15 @@
 import pandas as pd
+import numpy as np
 import geopandas as gpd
 from shapely import wkb
 import shapely
+import functools
+import hashlib
+import os
+
+# Arrow types of the raw traffic CSV columns for the pyarrow reader, see load_data_iter. Timestamps
+# stay text, so invalid ones are coerced to NaT by the traffic cleaning as with the pandas reader.
+TRAFFIC_CSV_TYPES = {'USER_ID': 'string', 'OCCURED_AT': 'string', 'LATITUDE': 'float64', 'LONGITUDE': 'float64'}
 
 def load_data(data_path):
     """Load data from CSV or Parquet based on file extension."""
@@ -12,16 +20,94 @@ def load_data(data_path):
     else:
         raise ValueError("Unsupported file format. Only CSV and Parquet are supported.")
 
+def load_data_iter(data_path, batch_size=1_000_000, columns=None, engine='pandas', column_types=None):
+    """
+    Yield data from CSV or Parquet in chunks of at most batch_size rows.
+
+    With engine='pyarrow' CSV files are parsed by the multi-threaded Arrow streaming reader;
+    column_types (column -> Arrow type name, e.g. 'float64') then fixes the types of the named
+    columns, so that they do not depend on the values of the first block.
+    """
+    if data_path.endswith('.csv') and engine == 'pyarrow':
+        yield from read_csv_batches_arrow(data_path, batch_size, columns, column_types)
+    elif data_path.endswith('.csv'):
+        yield from pd.read_csv(data_path, usecols=columns, chunksize=batch_size)
+    elif data_path.endswith('.parquet'):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(data_path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        raise ValueError("Unsupported file format. Only CSV and Parquet are supported.")
+
+def read_csv_batches_arrow(data_path, batch_size, columns=None, column_types=None):
+    """Yield a CSV file as DataFrames of batch_size rows (the last one may be shorter), parsed with pyarrow."""
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    column_types = {column: pa.type_for_alias(type_name) for column, type_name in (column_types or {}).items()}
+    convert_options = pa_csv.ConvertOptions(include_columns=columns, column_types=column_types)
+    reader = pa_csv.open_csv(data_path, read_options=pa_csv.ReadOptions(use_threads=True),
+                             convert_options=convert_options)
+
+    # The reader splits the file by bytes, so its batches are regrouped into batch_size rows
+    pending, pending_rows = [], 0
+    for batch in reader:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= batch_size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, batch_size).to_pandas()
+            rest = table.slice(batch_size)
+            pending, pending_rows = rest.to_batches(), rest.num_rows
+
+    if pending_rows:
+        yield pa.Table.from_batches(pending).to_pandas()
+
 def save_data(data, output_path):
     """Save data to CSV or Parquet based on file extension."""
     if output_path.endswith('.csv'):
         data.to_csv(output_path, index=False)
     elif output_path.endswith('.parquet'):
-        data.to_parquet(output_path, index=False)
+        # ZSTD with dictionary encoding keeps the files small; larger row groups speed up scans
+        data.to_parquet(output_path, index=False, compression='zstd', compression_level=3,
+                        row_group_size=131_072, use_dictionary=True)
     else:
         raise ValueError("Unsupported file format. Only CSV and Parquet are supported.")
     print(f"Cleaned data saved to {output_path}.")
 
+def content_hash(data):
+    """Hash the content of a DataFrame, index included."""
+    return hashlib.blake2b(pd.util.hash_pandas_object(data, index=True).values.tobytes(), digest_size=16).hexdigest()
+
+def disk_memoize(key_fn=content_hash):
+    """
+    Cache the DataFrame returned by a cleaning function as Parquet, keyed by key_fn(input).
+
+    The decorated function takes an extra cache_dir argument; without it the function runs
+    uncached. Because the key is derived from the input content, a cached result cannot be stale.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(data, cache_dir=None):
+            if cache_dir is None:
+                return function(data)
+
+            cache_path = os.path.join(cache_dir, f"{function.__name__}-{key_fn(data)}.parquet")
+            if os.path.exists(cache_path):
+                print(f"Cached result loaded from {cache_path}.")
+                return pd.read_parquet(cache_path)
+
+            result = function(data)
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary_path = cache_path + '.tmp'
+            result.to_parquet(temporary_path)
+            os.replace(temporary_path, cache_path)
+            return result
+        return wrapper
+    return decorator
+
 def remove_duplicates(data):
     """Remove duplicate rows from the DataFrame."""
     duplicates = data.duplicated()
@@ -33,28 +119,20 @@ def remove_duplicates(data):
         print("No duplicate rows found.")
     return data
 
-def remove_missing_values(data, key_columns):
-    """Remove rows with missing values in specified key columns."""
-    data = data.dropna(subset=key_columns)
-    print("Rows with missing values removed.")
-    return data
-
-def validate_coordinates(data, lat_col='LAT', lng_col='LNG'):
-    """Remove rows with invalid latitude/longitude values."""
-    data = data[(data[lng_col] >= -180) & (data[lng_col] <= 180) &
-                (data[lat_col] >= -90) & (data[lat_col] <= 90)]
-    print("Rows with invalid latitude/longitude values removed.")
-    return data
+def complete_rows_mask(data, key_columns):
+    """Boolean mask of the rows without missing values in the key columns."""
+    return data[key_columns].notna().all(axis=1)
 
-def remove_zero_coordinates(data, lat_col='LAT', lng_col='LNG'):
-    """Remove rows with zero or null latitude/longitude values."""
-    # Debug: print columns to check which are available
-    print(f"Available columns: {data.columns}")
+def valid_coordinates_mask(data, lat_col='LAT', lng_col='LNG'):
+    """Boolean mask of the rows with valid, non-zero latitude/longitude values."""
+    lat = data[lat_col]
+    lng = data[lng_col]
+    return lng.between(-180, 180) & lat.between(-90, 90) & (lng != 0) & (lat != 0)
 
-    data = data[(data[lng_col] != 0) & (data[lat_col] != 0) &
-                (~data[lng_col].isnull()) & (~data[lat_col].isnull())]
-    print("Rows with zero or null latitude/longitude values removed.")
-    return data
+def report_removed_rows(data, mask, reason):
+    """Print how many rows of data the mask removes."""
+    removed = len(data) - int(mask.sum())
+    print(f"Rows removed ({reason}): {removed}")
 
 def wkb_to_geometry(geometry):
     """Convert WKB or Shapely geometry to Shapely geometry."""
@@ -73,38 +151,116 @@ def wkb_to_geometry(geometry):
     else:
         raise TypeError(f"Expected bytes, Shapely geometry, or str, got {type(geometry).__name__}")
 
+def wkb_to_geometries(values):
+    """
+    Vectorized wkb_to_geometry over an object array; undecodable entries become None.
+
+    Binary values are parsed as WKB and text values as WKT, falling back to hex-encoded WKB.
+    """
+    geometries = values.copy()
+    is_geometry = shapely.is_geometry(values)
+    if is_geometry.all():
+        return geometries
+
+    is_text = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+    is_binary = ~is_geometry & ~is_text
+    geometries[is_binary] = shapely.from_wkb(values[is_binary], on_invalid='ignore')
+
+    if is_text.any():
+        text_geometries = shapely.from_wkt(values[is_text], on_invalid='ignore')
+        not_wkt = ~shapely.is_geometry(text_geometries)
+        text_geometries[not_wkt] = shapely.from_wkb(values[is_text][not_wkt], on_invalid='ignore')
+        geometries[is_text] = text_geometries
+    return geometries
+
+def traffic_rows_mask(traffic):
+    """
+    Boolean mask of the traffic rows that pass the row filters, and the parsed OCCURED_AT column.
+
+    Rows need all key columns, a parseable OCCURED_AT and valid, non-zero coordinates.
+    """
+    key_columns = ['USER_ID', 'OCCURED_AT', 'LONGITUDE', 'LATITUDE']
+    occured_at = pd.to_datetime(traffic['OCCURED_AT'], errors='coerce')
+    mask = (complete_rows_mask(traffic, key_columns) & occured_at.notna() &
+            valid_coordinates_mask(traffic, 'LATITUDE', 'LONGITUDE'))
+    return mask, occured_at
+
+def clean_traffic_rows(traffic, report=True):
+    """Apply the row filters of the traffic cleansing in a single pass; report=False skips the removed rows message."""
+    mask, occured_at = traffic_rows_mask(traffic)
+    if report:
+        report_removed_rows(traffic, mask, "missing values, invalid time or coordinates")
+    return traffic.loc[mask].assign(OCCURED_AT=occured_at[mask])
+
 def clean_traffic_data(traffic_input):
     """Load, clean, and save traffic data."""
-    traffic = remove_duplicates(traffic_input)
-    key_columns = ['USER_ID', 'OCCURED_AT', 'LONGITUDE', 'LATITUDE']
-    traffic = remove_missing_values(traffic, key_columns)
-    traffic = validate_coordinates(traffic, 'LATITUDE', 'LONGITUDE')
-    traffic = remove_zero_coordinates(traffic, 'LATITUDE', 'LONGITUDE')
-    return traffic
+    # Duplicates and invalid rows are dropped with one combined mask, so the table is copied once
+    mask, occured_at = traffic_rows_mask(traffic_input)
+    mask &= ~traffic_input.duplicated()
+    report_removed_rows(traffic_input, mask, "duplicates, missing values, invalid time or coordinates")
+    return traffic_input.loc[mask].assign(OCCURED_AT=occured_at[mask])
+
+def clean_traffic_data_chunked(chunks):
+    """
+    Clean traffic data read in chunks, e.g. from load_data_iter.
+
+    The row filters only look at one row at a time, so they run on each chunk as it is read and the
+    raw table is never held in memory as a whole. Duplicates are removed once over the kept rows,
+    which gives the same rows as clean_traffic_data.
+    """
+    # The per-chunk filter messages are replaced by a single summary below
+    cleaned_chunks = [clean_traffic_rows(chunk, report=False) for chunk in chunks]
+
+    if not cleaned_chunks:
+        return pd.DataFrame()
+
+    traffic = pd.concat(cleaned_chunks, ignore_index=True)
+    print("Rows with missing values, invalid time or coordinates removed.")
+    return remove_duplicates(traffic)
+
+def downcast_traffic_data(traffic):
+    """
+    Hold traffic coordinates as float32 in memory, which halves the memory read by the location
+    scans. Rounding moves a point by up to a few decimetres, so a signal that close to a location
+    boundary can change sides; cleaned data is saved before this cast and stays float64.
+    """
+    return traffic.astype({'LATITUDE': np.float32, 'LONGITUDE': np.float32})
 
 def clean_bud_data(bud_input):
     """Load, clean, and save BUD data."""
 
-    bud = remove_duplicates(bud_input)
-
     key_columns = ['LOKALNYID', 'FUNOGOLNABUDYNKU_DESC', 'LICZBAKONDYGNACJI', 'AREA', 'GEOMETRY']
-    bud = remove_missing_values(bud, key_columns)
 
     # Convert LICZBAKONDYGNACJI and AREA to numeric values
-    bud.loc[:, 'LICZBAKONDYGNACJI'] = pd.to_numeric(bud['LICZBAKONDYGNACJI'], errors='coerce')
-    bud.loc[:, 'AREA'] = pd.to_numeric(bud['AREA'], errors='coerce')
-
-    # Remove rows with invalid LICZBAKONDYGNACJI or AREA
-    bud = bud.dropna(subset=['LICZBAKONDYGNACJI', 'AREA'])
-    print("Invalid LICZBAKONDYGNACJI or AREA values removed.")
-
+    floors = pd.to_numeric(bud_input['LICZBAKONDYGNACJI'], errors='coerce')
+    area = pd.to_numeric(bud_input['AREA'], errors='coerce')
+
+    # Remove duplicates, rows with missing values and invalid LICZBAKONDYGNACJI or AREA in one pass
+    mask = ~bud_input.duplicated() & complete_rows_mask(bud_input, key_columns) & floors.notna() & area.notna()
+    report_removed_rows(bud_input, mask, "duplicates, missing values, invalid LICZBAKONDYGNACJI or AREA")
+    bud = bud_input.loc[mask].assign(LICZBAKONDYGNACJI=floors[mask], AREA=area[mask])
+
+    return downcast_bud_data(bud)
+
+def downcast_bud_data(bud):
+    """
+    Store the BUD columns used by the buildings analysis in compact types.
+
+    AREA becomes float32, LICZBAKONDYGNACJI the smallest unsigned integer type that holds it
+    (uint8 for real floor counts) and FUNOGOLNABUDYNKU_DESC a categorical.
+    """
+    bud = bud.copy()
+    bud['AREA'] = pd.to_numeric(bud['AREA'], errors='coerce').astype('float32')
+    floors = pd.to_numeric(bud['LICZBAKONDYGNACJI'], errors='coerce')
+    if floors.notna().all() and (floors >= 0).all():
+        floors = pd.to_numeric(floors, downcast='unsigned')
+    bud['LICZBAKONDYGNACJI'] = floors
+    bud['FUNOGOLNABUDYNKU_DESC'] = bud['FUNOGOLNABUDYNKU_DESC'].astype('category')
     return bud
 
 def clean_population_data(population_input):
     """Load, clean, and save population data."""
 
-    population = remove_duplicates(population_input)
-
     key_columns = [
         'FEMALE', 'MALE', 'FEMALE0003', 'FEMALE0307', 'FEMALE0812', 'FEMALE1315', 'FEMALE1618',
         'FEMALE1924', 'FEMALE2529', 'FEMALE3034', 'FEMALE3539', 'FEMALE4044', 'FEMALE4549',
@@ -115,29 +271,55 @@ def clean_population_data(population_input):
         'LAT', 'LNG', 'TOTAL'
     ]
 
-    population = remove_missing_values(population, key_columns)
-    population = validate_coordinates(population)
+    count_columns = key_columns[:-3]
 
     # Convert population columns to numeric values
-    population[key_columns[:-3]] = population[key_columns[:-3]].apply(pd.to_numeric, errors='coerce')
-
-    # Remove rows with invalid population values
-    population = population.dropna(subset=key_columns[:-3])
-    print("Invalid population values removed.")
-
+    counts = population_input[count_columns].apply(pd.to_numeric, errors='coerce')
+
+    # Remove duplicates, rows with missing values, invalid coordinates or population values in one pass
+    lat = population_input['LAT']
+    lng = population_input['LNG']
+    mask = (~population_input.duplicated() & complete_rows_mask(population_input, key_columns) &
+            lng.between(-180, 180) & lat.between(-90, 90) & counts.notna().all(axis=1))
+    report_removed_rows(population_input, mask, "duplicates, missing values, invalid coordinates or population values")
+
+    population = population_input.loc[mask].copy()
+    population[count_columns] = counts[mask]
+
+    return downcast_population_data(population, count_columns)
+
+def downcast_population_data(population, count_columns):
+    """
+    Store population counts in compact types.
+
+    Whole, non-negative counts become uint16, or uint32 where uint16 is too small; FEMALE and MALE
+    are at least uint32 so that their sum cannot overflow. LAT and LNG stay float64, so that
+    grid points on a location boundary are tested at their exact position.
+    """
+    population = population.copy()
+    for column in count_columns:
+        values = population[column]
+        if values.empty or values.min() < 0 or not (values % 1 == 0).all():
+            continue
+        fits_uint16 = values.max() <= np.iinfo(np.uint16).max and column not in ('FEMALE', 'MALE')
+        population[column] = values.astype(np.uint16 if fits_uint16 else np.uint32)
 
     return population
 
+@disk_memoize()
 def clean_locations(locations_input):
     """Load, clean, and save locations data."""
-    locations = remove_duplicates(locations_input)
     key_columns = ["location", "lat", "lng", "geometry"]
-    locations = remove_missing_values(locations, key_columns)
-    locations = remove_zero_coordinates(locations, 'lat', 'lng')
-    locations = validate_coordinates(locations, 'lat', 'lng')
-    #locations['geometry'] = locations['geometry'].apply(wkb_to_geometry)
+    mask = (~locations_input.duplicated() & complete_rows_mask(locations_input, key_columns) &
+            valid_coordinates_mask(locations_input, 'lat', 'lng')).to_numpy()
+
+    # Drop rows whose geometry cannot be decoded, parsing the remaining rows in one call
+    geometries = wkb_to_geometries(locations_input['geometry'].to_numpy(dtype=object)[mask])
+    mask[mask] = shapely.is_geometry(geometries)
+    report_removed_rows(locations_input, mask, "duplicates, missing values, invalid coordinates or geometry")
 
-    return locations
+    # Location names repeat across joins and group keys; a categorical keeps them as integer codes
+    return locations_input[mask].astype({'location': 'category'})
 
 if __name__ == "__main__":
     # Paths to the CSV and Parquet files
@@ -1,5 +1,6 @@
 import pandas as pd
-from shapely.geometry import Point, shape
+import numpy as np
+import shapely
 from shapely import wkb
 import matplotlib.pyplot as plt
 
@@ -20,30 +21,43 @@ def analyze_age_structure(population_data):
 
     return {"population_data": population_data, "female_percentage": female_percentage, "male_percentage": male_percentage}
 
-def filter_population_by_location(population_data, locations, location_name):
-    # Select location geometry for the specified location
-    location_geometry = locations.loc[locations['location'] == location_name, 'geometry'].values[0]
-
-    # Convert binary geometry to a Shapely shape
-    location_shape = wkb.loads(location_geometry)
-
-    # Filter population data based on whether each point is within the location shape
-    def is_within_location(row):
-        point = Point(row['LNG'], row['LAT'])
-        return point.within(location_shape)
-
-    population_data_filtered = population_data[population_data.apply(is_within_location, axis=1)]
-
-    # Add location information to the filtered population data
-    population_data_filtered = population_data_filtered.copy()  # Avoid SettingWithCopyWarning
-    population_data_filtered['GEOMETRY'] = location_geometry
-    population_data_filtered['LOCATION_NAME'] = location_name
+def filter_population_by_location(population_data, locations, location_name, location_index=None):
+    if location_index is not None:
+        # Geometry already parsed once by the caller (LocationsSoA)
+        location_shape = location_index.geometry(location_name)
+        location_geometry = location_shape.wkb
+    else:
+        # Select location geometry for the specified location
+        location_geometry = locations.loc[locations['location'] == location_name, 'geometry'].values[0]
+
+        # Convert binary geometry to a Shapely shape
+        location_shape = wkb.loads(location_geometry)
+
+    # Filter population data based on whether each point is within the location shape. The grid is
+    # national, so a bounding box test in NumPy first leaves only the nearby points for GEOS.
+    lng = population_data['LNG'].to_numpy(dtype=np.float64)
+    lat = population_data['LAT'].to_numpy(dtype=np.float64)
+    min_x, min_y, max_x, max_y = shapely.bounds(location_shape)
+    shapely.prepare(location_shape)
+    candidates = np.flatnonzero((lng >= min_x) & (lng <= max_x) & (lat >= min_y) & (lat <= max_y))
+
+    within_location = np.zeros(len(population_data), dtype=bool)
+    within_location[candidates] = shapely.contains_xy(location_shape, lng[candidates], lat[candidates])
+    # Select the rows and add location information to them in a single step
+    population_data_filtered = population_data.loc[within_location].assign(GEOMETRY=location_geometry,
+                                                                           LOCATION_NAME=location_name)
 
     return population_data_filtered
 
-def analyze_population_in_location(population_data, locations, location_name):
+def analyze_population_in_location(population_data, locations, location_name, location_index=None):
     # Filter population data for location
-    population_data = filter_population_by_location(population_data, locations, location_name)
+    population_data = filter_population_by_location(population_data, locations, location_name, location_index)
+
+    if location_index is not None:
+        location_lng, location_lat = location_index.centroids_xy[location_index.name_to_code[location_name]]
+    else:
+        location_lng = locations.loc[locations['location'] == location_name, 'lng'].values[0]
+        location_lat = locations.loc[locations['location'] == location_name, 'lat'].values[0]
 
     # Analyze age structure for location
     analyzed_population = analyze_age_structure(population_data)
@@ -51,8 +65,8 @@ def analyze_population_in_location(population_data, locations, location_name):
     # Add location information to the analyzed population data
     analyzed_population["location"] = {
         "location_name": location_name,
-        "LNG": locations.loc[locations['location'] == location_name, 'lng'].values[0],
-        "LAT": locations.loc[locations['location'] == location_name, 'lat'].values[0],
+        "LNG": location_lng,
+        "LAT": location_lat,
         "GEOMETRY": analyzed_population["population_data"].iloc[0]['GEOMETRY']
     }
     return analyzed_population
@@ -177,9 +191,10 @@ def plot_demographic_pyramid(demographic_distribution, location_name, output_fil
     plt.savefig(output_file)
     plt.close()
 
-def analyze_and_plot_population_data(population_data, locations, location_name, output_file='demographic_pyramid.jpg', plot=True):
+def analyze_and_plot_population_data(population_data, locations, location_name, output_file='demographic_pyramid.jpg', plot=True,
+                                     location_index=None):
     # Analyze population data for location
-    analyzed_population_data = analyze_population_in_location(population_data, locations, location_name)
+    analyzed_population_data = analyze_population_in_location(population_data, locations, location_name, location_index)
 
     # Summarize analyzed population data
     summarized_data = summarize_population_data(analyzed_population_data)
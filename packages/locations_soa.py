@@ -0,0 +1,120 @@
+from dataclasses import dataclass
+import numpy as np
+import shapely
+
+from packages.data_cleansing import wkb_to_geometries
+
+@dataclass(frozen=True)
+class LocationsSoA:
+    """
+    Column-wise (structure of arrays) view of the locations table.
+
+    Built once from the locations DataFrame and shared by the analyses, so that location
+    geometries are parsed a single time and loops over locations work on plain arrays.
+
+    Attributes:
+    names (ndarray): Location names.
+    codes (ndarray): int32 location codes, the position of each location in the arrays.
+    geoms (ndarray): Parsed Shapely geometries.
+    centroids_xy (ndarray): (N, 2) float64 array of location longitude/latitude.
+    name_to_code (dict): Location name -> code.
+    tree (STRtree): Spatial index over geoms; tree positions are location codes.
+    """
+    __slots__ = ('names', 'codes', 'geoms', 'centroids_xy', 'name_to_code', 'tree')
+
+    names: np.ndarray
+    codes: np.ndarray
+    geoms: np.ndarray
+    centroids_xy: np.ndarray
+    name_to_code: dict
+    tree: shapely.STRtree
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        # Frozen instances reject setattr, which default unpickling of slots relies on
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __len__(self):
+        return len(self.names)
+
+    def geometry(self, location_name):
+        """Return the parsed geometry of a location by name."""
+        return self.geoms[self.name_to_code[location_name]]
+
+    def lookup_codes(self, location_names):
+        """Resolve location names to an int32 array of codes; unknown names map to -1."""
+        return np.array([self.name_to_code.get(name, -1) for name in location_names], dtype=np.int32)
+
+    def locate_points(self, longitude, latitude, batch_size=1_000_000):
+        """
+        Find the locations containing each point with bulk STRtree queries.
+
+        Points are queried in batches so that at most batch_size point geometries exist at a time.
+
+        Parameters:
+        longitude (ndarray): Point longitudes.
+        latitude (ndarray): Point latitudes.
+        batch_size (int): Number of points per query.
+
+        Returns:
+        ndarray, ndarray: Point position and location code of each (point, location) hit, ordered
+                          by location code and then point position.
+        """
+        longitude = np.asarray(longitude, dtype=np.float64)
+        latitude = np.asarray(latitude, dtype=np.float64)
+        point_positions = [np.empty(0, dtype=np.intp)]
+        location_codes = [np.empty(0, dtype=np.intp)]
+
+        for start in range(0, len(longitude), batch_size):
+            points = shapely.points(longitude[start:start + batch_size], latitude[start:start + batch_size])
+            batch_positions, batch_codes = self.tree.query(points, predicate='within')
+            point_positions.append(batch_positions + start)
+            location_codes.append(batch_codes)
+
+        point_positions = np.concatenate(point_positions)
+        location_codes = np.concatenate(location_codes)
+        order = np.lexsort((point_positions, location_codes))
+        return point_positions[order], location_codes[order].astype(np.int32)
+
+def from_dataframe(locations):
+    """
+    Build a LocationsSoA from a locations DataFrame.
+
+    Column labels are matched case-insensitively. Locations whose geometry is missing or cannot
+    be decoded are dropped.
+
+    Parameters:
+    locations (DataFrame): DataFrame with location, geometry and optionally lat/lng columns.
+
+    Returns:
+    LocationsSoA: Column-wise locations.
+    """
+    if isinstance(locations, LocationsSoA):
+        return locations
+
+    columns = {column.lower(): column for column in locations.columns}
+    locations = locations.dropna(subset=[columns['geometry']])
+
+    geoms = wkb_to_geometries(locations[columns['geometry']].to_numpy(dtype=object))
+    valid = shapely.is_geometry(geoms)
+    geoms = geoms[valid]
+    # Every analysis tests many points against each location, so build the GEOS indexes once here
+    shapely.prepare(geoms)
+    names = locations[columns['location']].to_numpy(dtype=object)[valid]
+
+    if 'lng' in columns and 'lat' in columns:
+        centroids_xy = locations[[columns['lng'], columns['lat']]].to_numpy(dtype=np.float64)[valid]
+    else:
+        centroids_xy = shapely.get_coordinates(shapely.centroid(geoms))
+
+    return LocationsSoA(
+        names=names,
+        codes=np.arange(len(names), dtype=np.int32),
+        geoms=geoms,
+        centroids_xy=centroids_xy,
+        name_to_code={name: code for code, name in enumerate(names)},
+        tree=shapely.STRtree(geoms),
+    )
@@ -1,9 +1,11 @@
-from shapely.geometry import Point
-from shapely import wkb
-import shapely
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
+import numpy as np
+from packages import locations_soa
+
+# Nanoseconds in a day, for differences between int64 timestamps
+DAY_NS = 86_400 * 10**9
 
 def load_data(traffic_path, locations_path):
     """
@@ -26,35 +28,60 @@ def preprocess_data(traffic, locations):
     """
     traffic.columns = traffic.columns.str.upper()
     traffic['OCCURED_AT'] = pd.to_datetime(traffic['OCCURED_AT'])
-    locations.columns = locations.columns.str.upper()
-
-    locations = locations.dropna(subset=['GEOMETRY'])
-
-    def wkb_to_geometry(wkb_bytes):
-        try:
-            return wkb.loads(wkb_bytes, hex=True)
-        except shapely.errors.GEOSException:
-            return None
-
-    locations['GEOMETRY'] = locations['GEOMETRY'].apply(wkb_to_geometry)
-    locations = locations.dropna(subset=['GEOMETRY'])
+    locations = locations_soa.from_dataframe(locations)
 
     return traffic, locations
 
-def is_in_location(row, location):
+def location_hits(traffic, locations):
     """
-    Check if a user is in a specified location.
+    Build a long-form table of the signals inside each location.
+
+    Parameters:
+    traffic (DataFrame): DataFrame containing traffic data.
+    locations (LocationsSoA): Preprocessed locations.
+
+    Returns:
+    DataFrame: One row per (signal, location) hit, ordered by location and then signal, with the
+               signal columns and a categorical 'LOCATION' column.
     """
-    point = Point(row['LONGITUDE'], row['LATITUDE'])
-    return point.within(location.GEOMETRY)
+    signal_positions, location_codes = locations.locate_points(traffic['LONGITUDE'].to_numpy(),
+                                                               traffic['LATITUDE'].to_numpy())
+    location_names = pd.Categorical.from_codes(location_codes, categories=locations.names)
+    return traffic.iloc[signal_positions].assign(LOCATION=location_names)
 
-def add_location_columns(traffic, locations):
+def filter_repeat_visits(location_codes, user_codes, occured_at_ns, max_days=14):
     """
-    Add a column with the location name for each signal record.
+    Find the repeat visits in one vectorized scan over signals sorted by location, user and time.
+
+    A signal is kept when it is at least the third visit of the user in the location and comes at
+    most max_days whole days after the user's previous visit there.
+
+    Parameters:
+    location_codes (ndarray): Location code of each signal.
+    user_codes (ndarray): User code of each signal, -1 for a missing user.
+    occured_at_ns (ndarray): int64 signal timestamps in nanoseconds, NaT as the minimum int64.
+    max_days (int): Largest number of whole days since the previous visit.
+
+    Returns:
+    ndarray, ndarray: Positions of the kept signals and their visit numbers.
     """
-    for location in locations.itertuples():
-        traffic[location.LOCATION] = traffic.apply(is_in_location, axis=1, args=(location,))
-    return traffic
+    n = len(location_codes)
+    # Consecutive signals of the same user in the same location
+    same_visitor = ((location_codes[1:] == location_codes[:-1]) & (user_codes[1:] == user_codes[:-1])
+                    & (user_codes[1:] >= 0))
+
+    # Visit number from the position of the first signal of each (location, user) run
+    run_starts = np.flatnonzero(np.r_[True, ~same_visitor])
+    run_lengths = np.diff(np.r_[run_starts, n])
+    visit_count = np.arange(n) - np.repeat(run_starts, run_lengths) + 1
+
+    # Whole days since the previous signal are at most max_days when the difference is below max_days + 1 days
+    nat = np.iinfo(np.int64).min
+    has_times = (occured_at_ns[1:] != nat) & (occured_at_ns[:-1] != nat)
+    recent = np.diff(occured_at_ns) < (max_days + 1) * DAY_NS
+
+    positions = np.flatnonzero(same_visitor & has_times & recent & (visit_count[1:] > 2)) + 1
+    return positions, visit_count[positions]
 
 def get_repeat_visits_df(traffic, locations):
     """
@@ -62,71 +89,65 @@ def get_repeat_visits_df(traffic, locations):
 
     Parameters:
     traffic (DataFrame): DataFrame containing traffic data.
-    locations (DataFrame): DataFrame containing location data with geometry.
+    locations (LocationsSoA): Preprocessed locations.
 
     Returns:
     DataFrame, dict: DataFrame containing repeat visit details, and dictionary with location names as keys and repeat visit counts as values.
     """
-    repeat_visits_details = []
-    repeat_visits_summary = {}
-
-    for location in locations.itertuples():
-        location_traffic = traffic[traffic[location.LOCATION]].copy()
-        user_visit_counts = location_traffic.groupby('USER_ID').size()
-        repeat_users = user_visit_counts[user_visit_counts > 1].index
-        repeat_visits = location_traffic[location_traffic['USER_ID'].isin(repeat_users)].copy()
-
-        # Add a visit count column to track the number of visits by each user
-        repeat_visits['VISIT_COUNT'] = repeat_visits.groupby('USER_ID').cumcount() + 1
-
-        # Filter only the repeated visits
-        repeat_visits = repeat_visits[repeat_visits['VISIT_COUNT'] > 1]
-
-        # Calculate the time difference between visits
-        repeat_visits['PREVIOUS_VISIT'] = repeat_visits.groupby('USER_ID')['OCCURED_AT'].shift(1)
-        repeat_visits['TIME_DIFF_DAYS'] = (repeat_visits['OCCURED_AT'] - repeat_visits['PREVIOUS_VISIT']).dt.days
+    # All locations are processed together instead of one pass per location
+    hits = location_hits(traffic, locations)
+    location_codes = hits['LOCATION'].cat.codes.to_numpy()
+    user_codes, users = pd.factorize(hits['USER_ID'])
+    # Reuse the factorized user ids as a categorical column, so later groupbys work on int codes
+    hits['USER_ID'] = pd.Categorical.from_codes(user_codes, categories=users)
+    occured_at_ns = hits['OCCURED_AT'].to_numpy(dtype='datetime64[ns]').view(np.int64)
 
-        # Filter out visits with a time difference greater than 14 days
-        repeat_visits = repeat_visits[repeat_visits['TIME_DIFF_DAYS'] <= 14]
+    # Put the visits of each user in a location together and in time order; ties keep the input order
+    order = np.lexsort((occured_at_ns, user_codes, location_codes))
+    positions, visit_count = filter_repeat_visits(location_codes[order], user_codes[order], occured_at_ns[order])
 
-        # Add the location name to the repeat visits DataFrame
-        repeat_visits['LOCATION'] = location.LOCATION
+    # The previous visit is the signal just before each kept one
+    kept = order[positions]
+    previous_visit = hits['OCCURED_AT'].to_numpy()[order[positions - 1]]
+    repeat_visits_df = hits.iloc[kept].assign(VISIT_COUNT=visit_count, PREVIOUS_VISIT=previous_visit)
+    repeat_visits_df['TIME_DIFF_DAYS'] = (repeat_visits_df['OCCURED_AT'] - repeat_visits_df['PREVIOUS_VISIT']).dt.days
 
-        repeat_visits_details.append(repeat_visits)
-        repeat_visits_summary[location.LOCATION] = repeat_visits['USER_ID'].nunique()
+    repeat_users = repeat_visits_df.groupby('LOCATION', observed=False)['USER_ID'].nunique()
+    repeat_visits_summary = {name: int(repeat_users.get(name, 0)) for name in locations.names}
 
-    repeat_visits_df = pd.concat(repeat_visits_details)
     return repeat_visits_df, repeat_visits_summary
 
 def calculate_visit_frequencies(repeat_visits_df):
     """
     Calculate the visit frequencies for each location and return a summary DataFrame.
     """
-    visit_frequency_summary = []
-
-    grouped = repeat_visits_df.groupby(['LOCATION', 'USER_ID']).size().reset_index(name='VISIT_COUNT')
-    for location, group in grouped.groupby('LOCATION'):
-        total_users = group['USER_ID'].nunique()
-        visit_counts = group['VISIT_COUNT'].value_counts().sort_index()
-
-        visit_frequency_percentages = (visit_counts / total_users * 100).reset_index()
-        visit_frequency_percentages.columns = ['VISIT_COUNT', 'PERCENTAGE']
-        visit_frequency_percentages['LOCATION'] = location
-
-        visit_frequency_summary.append(visit_frequency_percentages)
-
-    visit_frequency_summary_df = pd.concat(visit_frequency_summary, ignore_index=True)
+    # Number of repeat visits of each user in each location
+    user_visits = repeat_visits_df.groupby(['LOCATION', 'USER_ID'], observed=True).size()
+    location_codes, location_names = pd.factorize(user_visits.index.get_level_values('LOCATION'), sort=True)
+    visit_counts = user_visits.to_numpy()
+
+    # Users per (location, visit count) in one bincount over flattened indexes, instead of a value_counts per location
+    width = visit_counts.max() + 1
+    users_per_count = np.bincount(location_codes * width + visit_counts,
+                                  minlength=len(location_names) * width).reshape(len(location_names), width)
+    total_users = users_per_count.sum(axis=1)
+
+    # Rows ordered by location and then visit count, as the per-location summaries were concatenated
+    location_index, visit_count = np.nonzero(users_per_count)
+    visit_frequency_summary_df = pd.DataFrame({
+        'VISIT_COUNT': visit_count,
+        'PERCENTAGE': users_per_count[location_index, visit_count] / total_users[location_index] * 100,
+        'LOCATION': np.asarray(location_names, dtype=object)[location_index],
+    })
     return visit_frequency_summary_df
 
-
-
 def calculate_and_return_repeat_frequencies(traffic, locations):
     """
     Modified function to calculate repeat visit details and return summaries.
 
     Parameters:
     traffic (DataFrame): DataFrame containing traffic data.
-    locations (DataFrame): DataFrame containing location data with geometry.
+    locations (DataFrame or LocationsSoA): Location data with geometry.
 
     Returns:
     dict, DataFrame: Dictionary with location names as keys and repeat visit counts as values,
@@ -136,9 +157,6 @@ def calculate_and_return_repeat_frequencies(traffic, locations):
     # Preprocess data
     traffic, locations = preprocess_data(traffic, locations)
 
-    # Add location columns to traffic data
-    traffic = add_location_columns(traffic, locations)
-
     # Get details of repeat visits for each location
     repeat_visits_df, repeat_visits_summary = get_repeat_visits_df(traffic, locations)
 
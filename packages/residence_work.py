@@ -1,68 +1,156 @@
 import pandas as pd
-import pygeos
+import numpy as np
+import shapely
 
 def load_data():
-    # Load user traffic data
-    traffic = pd.read_csv('traffic.csv')
+    # Load user traffic data, with lower-case columns and parsed timestamps from the start
+    traffic = normalize_column_names(pd.read_csv('traffic.csv'))
+    traffic['occured_at'] = pd.to_datetime(traffic['occured_at'])
 
     # Load locations data
-    locations = pd.read_parquet('locations.parquet')
+    locations = normalize_column_names(pd.read_parquet('locations.parquet'))
 
     return traffic, locations
 
 def normalize_column_names(df):
-    df.columns = map(str.lower, df.columns)
+    # Frames are normalized in place, so later calls on the same frame leave it as it is
+    if any(not isinstance(column, str) or column != column.lower() for column in df.columns):
+        df.columns = map(str.lower, df.columns)
     return df
 
-def find_users_between_locations(traffic, locations, location1, location2):
+def get_location_geometry(locations, location_name, location_index=None):
+    """
+    Return the parsed geometry of a location, or None if the location is unknown.
+
+    With location_index (a LocationsSoA built once by the caller) this is a dictionary lookup;
+    otherwise the locations DataFrame is scanned and the WKB parsed.
+    """
+    if location_index is not None:
+        location_code = location_index.name_to_code.get(location_name)
+        return None if location_code is None else location_index.geoms[location_code]
+
+    location_geometry_bytes = locations.loc[locations['location'] == location_name, 'geometry'].values
+    if len(location_geometry_bytes) == 0:
+        return None
+    location_geometry = shapely.from_wkb(location_geometry_bytes[0])
+    # The geometry is tested against many signals, so build its GEOS index once
+    shapely.prepare(location_geometry)
+    return location_geometry
+
+def filter_traffic_to_locations(traffic, locations, location_names, location_index=None):
+    """
+    Keep only the signals inside the bounding box of any of the given locations.
+
+    Every step of analyze_travel_and_users only looks at signals inside its two locations, so
+    this cheap vectorized pre-filter can run once before the per-row geometry tests.
+    """
     traffic = normalize_column_names(traffic)
     locations = normalize_column_names(locations)
 
-    try:
-        location1_geometry_bytes = locations.loc[locations['location'] == location1, 'geometry'].values[0]
-        location2_geometry_bytes = locations.loc[locations['location'] == location2, 'geometry'].values[0]
-    except IndexError:
+    longitude = traffic['longitude'].to_numpy()
+    latitude = traffic['latitude'].to_numpy()
+    mask = np.zeros(len(traffic), dtype=bool)
+
+    for location_name in location_names:
+        location_geometry = get_location_geometry(locations, location_name, location_index)
+        if location_geometry is None:
+            continue
+        min_x, min_y, max_x, max_y = shapely.bounds(location_geometry)
+        mask |= (longitude >= min_x) & (longitude <= max_x) & (latitude >= min_y) & (latitude <= max_y)
+
+    return traffic.loc[mask].copy()
+
+def within_location_mask(data, location_geometry):
+    """
+    Boolean mask of the signals of data that intersect a location geometry.
+
+    The location's bounding box is tested first with NumPy comparisons, so the exact GEOS test
+    only runs on the signals inside the box.
+    """
+    # The box test runs on the stored (float32) coordinates; only the candidates are widened for GEOS
+    longitude = data['longitude'].to_numpy()
+    latitude = data['latitude'].to_numpy()
+
+    min_x, min_y, max_x, max_y = shapely.bounds(location_geometry)
+    candidates = np.flatnonzero((longitude >= min_x) & (longitude <= max_x) &
+                                (latitude >= min_y) & (latitude <= max_y))
+
+    mask = np.zeros(len(data), dtype=bool)
+    mask[candidates] = shapely.intersects_xy(location_geometry, longitude[candidates].astype(np.float64),
+                                             latitude[candidates].astype(np.float64))
+    return mask
+
+def location_signals(traffic, locations, location_name, location_index=None):
+    """
+    Return the signals of traffic inside a location, or None if the location is unknown.
+
+    analyze_travel_and_users runs several times with the same commute location, so callers can
+    select that location's signals once and pass them in.
+    """
+    traffic = normalize_column_names(traffic)
+    locations = normalize_column_names(locations)
+
+    location_geometry = get_location_geometry(locations, location_name, location_index)
+    if location_geometry is None:
+        return None
+    return traffic[within_location_mask(traffic, location_geometry)]
+
+def find_users_between_locations(traffic, locations, location1, location2, location_index=None,
+                                 location1_signals=None):
+    """
+    Find the users seen in both locations.
+
+    location1_signals are the signals inside location1 if the caller already selected them,
+    see location_signals.
+    """
+    if location1_signals is None:
+        location1_signals = location_signals(traffic, locations, location1, location_index)
+    location2_signals = location_signals(traffic, locations, location2, location_index)
+    if location1_signals is None or location2_signals is None:
         print(f"Location '{location1}' or '{location2}' not found in the locations dataset.")
         return None
 
-    location1_geometry = pygeos.io.from_wkb(location1_geometry_bytes)
-    location2_geometry = pygeos.io.from_wkb(location2_geometry_bytes)
-
-    def is_within_location(row, geometry):
-        user_geometry = pygeos.points(row['longitude'], row['latitude'])
-        return pygeos.intersects(user_geometry, geometry)
-
-    users_in_location1 = traffic[traffic.apply(is_within_location, axis=1, geometry=location1_geometry)]
-    users_in_location2 = traffic[traffic.apply(is_within_location, axis=1, geometry=location2_geometry)]
-
-    commuting_users = pd.merge(users_in_location1, users_in_location2, on='user_id')
+    # Intersect the user ids seen in each location instead of joining the signal rows, which
+    # produced one row per pair of signals of every commuting user
+    commuting_user_ids = np.intersect1d(location1_signals['user_id'].dropna().unique(),
+                                        location2_signals['user_id'].dropna().unique(), assume_unique=True)
+    commuting_users = pd.DataFrame({'user_id': commuting_user_ids})
     return commuting_users
 
 
-def filter_time_signals(traffic, later_than=22, earlier_than=5):
+def time_signals_mask(traffic, later_than=22, earlier_than=5):
+    """
+    Boolean mask of the signals from later_than o'clock to before earlier_than o'clock.
+
+    Timestamps are parsed in place only if the column is not already datetime, so repeated
+    calls on the same traffic parse it once.
+    """
     traffic = normalize_column_names(traffic)
 
     # Convert timestamp to datetime
-    traffic['occured_at'] = pd.to_datetime(traffic['occured_at'])
+    if not pd.api.types.is_datetime64_any_dtype(traffic['occured_at']):
+        traffic['occured_at'] = pd.to_datetime(traffic['occured_at'])
+
+    # Missing times get hour -1, which the bounds below exclude as the original comparison did
+    hours = traffic['occured_at'].dt.hour.fillna(-1).to_numpy(dtype=np.int8)
+    return (hours >= later_than) | ((hours >= 0) & (hours < earlier_than))
 
+def filter_time_signals(traffic, later_than=22, earlier_than=5):
     # Filter signals between 22:00 and 05:00
-    night_signals = traffic[(traffic['occured_at'].dt.hour >= later_than) | (traffic['occured_at'].dt.hour < earlier_than)]
+    night_signals = traffic[time_signals_mask(traffic, later_than, earlier_than)]
     return night_signals
 
-def estimate_user_locations(travel_data, locations_data, location_name):
+def estimate_user_locations(travel_data, locations_data, location_name, location_index=None):
     travel_data = normalize_column_names(travel_data)
     locations_data = normalize_column_names(locations_data)
 
-    # Retrieve binary geometry for the specified location
-    location_geometry_bytes = locations_data.loc[locations_data['location'] == location_name, 'geometry'].values[0]
-    location_geometry = pygeos.io.from_wkb(location_geometry_bytes)
-
-    def is_within_location(row, geometry):
-        user_geometry = pygeos.points(row['longitude'], row['latitude'])
-        return pygeos.intersects(user_geometry, geometry)
+    # Retrieve the geometry for the specified location
+    location_geometry = get_location_geometry(locations_data, location_name, location_index)
+    if location_geometry is None:
+        raise IndexError(f"Location '{location_name}' not found in the locations dataset.")
 
     # Filter travel data to include only users in the specified location
-    users_in_location = travel_data[travel_data.apply(is_within_location, axis=1, geometry=location_geometry)]
+    users_in_location = travel_data[within_location_mask(travel_data, location_geometry)]
 
     # Calculate mean location of users in the specified location
     home_locations = users_in_location.groupby('user_id').agg({
@@ -77,20 +165,25 @@ def analyze_user_movements(traffic, locations, location1, location2):
     commuting_users = find_users_between_locations(traffic, locations, location1, location2)
     return commuting_users
 
-def analyze_travel_and_users(traffic, locations, location1, location2, later_than=22, earlier_than=5):
+def analyze_travel_and_users(traffic, locations, location1, location2, later_than=22, earlier_than=5,
+                             location_index=None, location1_signals=None):
     # Find users traveling between location1 and location2
-    traveling_users = find_users_between_locations(traffic, locations, location1, location2)
+    traveling_users = find_users_between_locations(traffic, locations, location1, location2, location_index,
+                                                   location1_signals)
 
     if traveling_users is None or traveling_users.empty:
         print(f"No users found traveling between {location1} and {location2}.")
         return {'travel': None, 'users': None, 'estimated_locations': None}
 
-    # Filter for time signals between location1 and location2 during specified hours
-    time_filtered_traffic = filter_time_signals(traffic, later_than, earlier_than)
-    time_filtered_users = time_filtered_traffic[time_filtered_traffic['user_id'].isin(traveling_users['user_id'])]
+    # Filter for time signals between location1 and location2 during specified hours; the hour and
+    # user masks are combined on plain arrays and each result is selected once
+    time_mask = time_signals_mask(traffic, later_than, earlier_than)
+    user_mask = traffic['user_id'].isin(traveling_users['user_id'].unique()).to_numpy()
+    time_filtered_traffic = traffic[time_mask]
+    time_filtered_users = traffic[time_mask & user_mask]
 
     # Estimate user locations for users in location1
-    estimated_locations = estimate_user_locations(time_filtered_users, locations, location2)
+    estimated_locations = estimate_user_locations(time_filtered_users, locations, location2, location_index)
 
     return {'travel': time_filtered_traffic, 'users': time_filtered_users, 'estimated_locations': estimated_locations}
 
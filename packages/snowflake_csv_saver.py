@@ -1,8 +1,8 @@
-import snowflake.connector
-import pandas as pd
+import pyarrow.csv as pa_csv
 import os
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
+from packages.snowflake_data_handler import get_connection
 
 def read_config(config_file):
     """
@@ -18,42 +18,6 @@ def read_config(config_file):
     config.read(config_file)
     return config['Snowflake']
 
-def get_connection(config):
-    """
-    Establish a connection to Snowflake.
-
-    Parameters:
-    config (ConfigParser): Configuration object.
-
-    Returns:
-    snowflake.connector.connection: Snowflake connection object.
-    """
-    USER = config.get('USER')
-    PASSWORD = config.get('PASSWORD')
-    ACCOUNT = config.get('ACCOUNT')
-    REGION = config.get('REGION')
-    DATABASE = config.get('DATABASE')
-    SCHEMA = config.get('SCHEMA')
-
-    url = f'snowflake://{USER}:{PASSWORD}@{ACCOUNT}.{REGION}.azure/{DATABASE}/{SCHEMA}'
-    parsed_url = urlparse(url)
-
-    user = parsed_url.username
-    password = parsed_url.password
-    account_region = parsed_url.hostname.split('.')
-    account = account_region[0]
-    region = account_region[1]
-    database = parsed_url.path.split('/')[1]
-    schema = parsed_url.path.split('/')[2]
-
-    return snowflake.connector.connect(
-        user=user,
-        password=password,
-        account=f"{account}.{region}.azure",
-        database=database,
-        schema=schema
-    )
-
 def save_table_to_csv(cursor, table_name, schema, database, output_dir):
     """
     Save table data to a CSV file.
@@ -67,31 +31,60 @@ def save_table_to_csv(cursor, table_name, schema, database, output_dir):
     """
     query = f"SELECT * FROM {database}.{schema}.{table_name}"
     cursor.execute(query)
-    df = pd.DataFrame.from_records(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
     file_path = os.path.join(output_dir, f"{table_name}.csv")
-    df.to_csv(file_path, index=False)
+
+    # The result is streamed to the file one Arrow batch at a time, so only one batch is held in memory
+    with open(file_path, 'wb') as file:
+        include_header = True
+        for batch in cursor.fetch_arrow_batches():
+            # Each batch is written on its own, so batches whose column types differ are not a problem
+            write_options = pa_csv.WriteOptions(include_header=include_header, quoting_style='needed')
+            pa_csv.write_csv(batch, file, write_options=write_options)
+            include_header = False
+
+        if include_header:
+            # No batches for an empty table, write the header only
+            file.write((','.join(desc[0] for desc in cursor.description) + '\n').encode())
+
     print(f"Saved {table_name} to {file_path}")
 
-def download_csv_files(config_file, input):
+def save_table_with_own_cursor(connection, table_name, schema, database, output_dir):
+    """
+    Save a table to CSV on a new cursor of the connection, so that tables can be saved from several threads.
+    """
+    cursor = connection.cursor()
+    try:
+        save_table_to_csv(cursor, table_name, schema, database, output_dir)
+    finally:
+        cursor.close()
+
+def download_csv_files(config_file, input, max_workers=8):
     config = read_config(config_file)
+    # Shared with snowflake_data_handler; the connection stays open for later calls and is closed at exit
     connection = get_connection(config)
 
-    try:
-        cursor = connection.cursor()
-        os.makedirs("data", exist_ok=True)
+    cursor = connection.cursor()
+    os.makedirs("data", exist_ok=True)
 
-        try:
-            query = f"SHOW TABLES IN SCHEMA {config.get('DATABASE')}.{config.get('SCHEMA')}"
-            cursor.execute(query)
-            tables = cursor.fetchall()
-
-            for table in tables:
-                table_name = table[1]
-                save_table_to_csv(cursor, table_name, config.get('SCHEMA'), config.get('DATABASE'), input)
-        finally:
-            cursor.close()
+    try:
+        query = f"SHOW TABLES IN SCHEMA {config.get('DATABASE')}.{config.get('SCHEMA')}"
+        cursor.execute(query)
+        tables = cursor.fetchall()
     finally:
-        connection.close()
+        cursor.close()
+
+    if not tables:
+        return
+
+    # Tables are downloaded concurrently, one cursor per table; the connector waits on the
+    # network without holding the GIL, so threads overlap the downloads
+    with ThreadPoolExecutor(max_workers=min(len(tables), max_workers)) as executor:
+        futures = [executor.submit(save_table_with_own_cursor, connection, table[1], config.get('SCHEMA'),
+                                   config.get('DATABASE'), input)
+                   for table in tables]
+        for future in futures:
+            # Re-raise the first download error
+            future.result()
 
 if __name__ == "__main__":
     download_csv_files("config.ini", "input")
@@ -1,6 +1,6 @@
 import snowflake.connector
 import pandas as pd
-from urllib.parse import urlparse
+import atexit
 from configparser import ConfigParser
 
 def read_config(config_file):
@@ -17,9 +17,15 @@ def read_config(config_file):
     config.read(config_file)
     return config['Snowflake']
 
+# (user, account, database, schema) -> open Snowflake connection, see get_connection
+_connections = {}
+
 def get_connection(config):
     """
-    Establish a connection to Snowflake.
+    Establish a connection to Snowflake, reusing the open connection for the same settings.
+
+    Opening a session costs a TLS handshake and authentication, so one connection per set of
+    settings is kept for the whole process and closed at exit, see close_connections.
 
     Parameters:
     config (ConfigParser): Configuration object.
@@ -27,31 +33,44 @@ def get_connection(config):
     Returns:
     snowflake.connector.connection: Snowflake connection object.
     """
-    USER = config.get('USER')
-    PASSWORD = config.get('PASSWORD')
-    ACCOUNT = config.get('ACCOUNT')
-    REGION = config.get('REGION')
-    DATABASE = config.get('DATABASE')
-    SCHEMA = config.get('SCHEMA')
-
-    url = f'snowflake://{USER}:{PASSWORD}@{ACCOUNT}.{REGION}.azure/{DATABASE}/{SCHEMA}'
-    parsed_url = urlparse(url)
-
-    user = parsed_url.username
-    password = parsed_url.password
-    account_region = parsed_url.hostname.split('.')
-    account = account_region[0]
-    region = account_region[1]
-    database = parsed_url.path.split('/')[1]
-    schema = parsed_url.path.split('/')[2]
-
-    return snowflake.connector.connect(
-        user=user,
-        password=password,
-        account=f"{account}.{region}.azure",
-        database=database,
-        schema=schema
-    )
+    account = f"{config.get('ACCOUNT')}.{config.get('REGION')}.azure"
+    key = (config.get('USER'), account, config.get('DATABASE'), config.get('SCHEMA'))
+
+    connection = _connections.get(key)
+    if connection is None or connection.is_closed():
+        connection = snowflake.connector.connect(
+            user=config.get('USER'),
+            password=config.get('PASSWORD'),
+            account=account,
+            database=config.get('DATABASE'),
+            schema=config.get('SCHEMA')
+        )
+        _connections[key] = connection
+    return connection
+
+@atexit.register
+def close_connections():
+    """Close the connections opened by get_connection."""
+    for connection in _connections.values():
+        connection.close()
+    _connections.clear()
+
+def fetch_dataframe(cursor):
+    """
+    Build a DataFrame from the result of the last executed query.
+
+    The result is fetched in Arrow batches, which skips building a Python tuple per row.
+
+    Parameters:
+    cursor (snowflake.connector.cursor): Cursor with an executed query.
+
+    Returns:
+    DataFrame: Query result.
+    """
+    batches = list(cursor.fetch_pandas_batches())
+    if not batches:
+        return pd.DataFrame(columns=[desc[0] for desc in cursor.description])
+    return pd.concat(batches, ignore_index=True)
 
 def fetch_data(connection, database, schema):
     """
@@ -77,8 +96,7 @@ def fetch_data(connection, database, schema):
             table_name = table[1]
             query = f"SELECT * FROM {database}.{schema}.{table_name}"
             cursor.execute(query)
-            df = pd.DataFrame.from_records(cursor.fetchall(), columns=[desc[0] for desc in cursor.description])
-            dataframes[table_name] = df
+            dataframes[table_name] = fetch_dataframe(cursor)
     finally:
         cursor.close()
 
@@ -88,12 +106,8 @@ def sql_to_dataframes(config_file):
     config = read_config(config_file)
     connection = get_connection(config)
 
-    try:
-        dataframes = fetch_data(connection, config.get('DATABASE'), config.get('SCHEMA'))
-    finally:
-        connection.close()
-
-    return dataframes
+    # The connection stays open for later calls and is closed at exit
+    return fetch_data(connection, config.get('DATABASE'), config.get('SCHEMA'))
 
 if __name__ == "__main__":
     sql_to_dataframes("config.ini")
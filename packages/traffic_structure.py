@@ -1,69 +1,154 @@
 import pandas as pd
-import geopandas as gpd
+import numpy as np
+from scipy.spatial import cKDTree
+import matplotlib
+matplotlib.use('Agg')  # Plots are only written to files, no GUI backend is needed
 import matplotlib.pyplot as plt
-
-def match_traffic_to_location(traffic, locations):
-    """Match each traffic record to the nearest location."""
-    # Convert traffic DataFrame to GeoDataFrame
-    traffic_gdf = gpd.GeoDataFrame(
-        traffic, geometry=gpd.points_from_xy(traffic['longitude'], traffic['latitude']), crs="EPSG:4326"
-    )
-
-    # Convert locations DataFrame to GeoDataFrame and set CRS
-    locations_gdf = gpd.GeoDataFrame(locations, geometry=gpd.points_from_xy(locations['lng'], locations['lat']), crs="EPSG:4326")
-
-    # Perform spatial join to find the nearest location
-    traffic_with_locations = gpd.sjoin_nearest(traffic_gdf, locations_gdf, how='left', distance_col='distance')
-
-    return traffic_with_locations
-
-def calculate_hourly_structure(location, traffic):
-    """Calculate the hourly structure of signals for a given location."""
-    location_visits = traffic[traffic['location'] == location]
-    location_visits['hour'] = location_visits['occured_at'].dt.hour
-    hourly_distribution = (location_visits.groupby('hour').size() / len(location_visits)) * 100  # Multiply by 100 to get percentage
-    return hourly_distribution
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Mean Earth radius in metres, for great-circle distances
+EARTH_RADIUS_M = 6_371_000.0
+
+def to_unit_vectors(latitude, longitude):
+    """Convert latitude/longitude in degrees (float32 or float64) to (N, 3) float64 points on the unit sphere."""
+    # deg2rad writes straight into new float64 arrays, so float32 input is not copied first
+    lat = np.deg2rad(latitude, dtype=np.float64)
+    lng = np.deg2rad(longitude, dtype=np.float64)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+def build_locations_tree(locations):
+    """Build the KD-tree of the location points on the unit sphere, see nearest_location_codes."""
+    return cKDTree(to_unit_vectors(locations['lat'], locations['lng']))
+
+def nearest_location_codes(latitude, longitude, tree, name_codes):
+    """
+    Find the nearest location of each signal by great-circle distance.
+
+    Points are placed on the unit sphere, where the straight-line (chord) distance grows with the
+    great-circle distance, so a KD-tree over the locations finds the same nearest location as a
+    haversine search.
+
+    Parameters:
+    latitude (ndarray): Signal latitudes (float32 or float64).
+    longitude (ndarray): Signal longitudes.
+    tree (cKDTree): Location tree, see build_locations_tree.
+    name_codes (ndarray): Code of the location name of each tree point, see pd.factorize.
+
+    Returns:
+    ndarray, ndarray: Location name code of each signal (-1 without valid coordinates) and the
+                      great-circle distance to it in metres (NaN without valid coordinates).
+    """
+    # Coordinates stay in their stored (float32) type; only the sphere points are float64, as cKDTree needs
+    valid = np.isfinite(latitude) & np.isfinite(longitude)
+
+    # workers=-1 spreads the queries over all CPU cores
+    chord, nearest = tree.query(to_unit_vectors(latitude[valid], longitude[valid]), k=1, workers=-1)
+
+    location_codes = np.full(len(latitude), -1, dtype=name_codes.dtype)
+    location_codes[valid] = name_codes[nearest]
+    distance = np.full(len(latitude), np.nan)
+    distance[valid] = 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(chord / 2, 1.0))
+    return location_codes, distance
+
+def signal_hours(occured_at):
+    """Return the int8 hour of each timestamp of a datetime Series, -1 where the time is missing."""
+    if occured_at.dt.tz is not None:
+        # Local hours of time zone aware timestamps need the accessor
+        return occured_at.dt.hour.fillna(-1).to_numpy(dtype=np.int8)
+
+    # Naive timestamps: whole hours since the epoch modulo 24, without the accessor
+    timestamps = occured_at.to_numpy()
+    hours = (timestamps.astype('datetime64[h]').view(np.int64) % 24).astype(np.int8)
+    hours[np.isnat(timestamps)] = -1
+    return hours
+
+def hour_counts(location_codes, hours, n_locations):
+    """
+    Count signals per (location code, hour) into a (n_locations x 24) int64 array.
+
+    Signals with a negative location code or hour (no location or time) are left out.
+    """
+    counted = (location_codes >= 0) & (hours >= 0)
+    flat_index = location_codes[counted].astype(np.int64) * 24 + hours[counted].astype(np.int64)
+
+    # Signals per (location, hour) in one bincount instead of a groupby
+    return np.bincount(flat_index, minlength=n_locations * 24).reshape(-1, 24)
+
+def hourly_percentages(counts):
+    """Turn (locations x 24) signal counts into float32 percentages per location; NaN rows where there are no signals."""
+    counts = counts.astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (counts / counts.sum(axis=1, keepdims=True) * 100).astype(np.float32)  # Multiply by 100 to get percentage
 
 def plot_hourly_structures(hourly_structures, output_jpg):
-    """Plot hourly structures for each location."""
-    fig, ax = plt.subplots(len(hourly_structures), 1, figsize=(10, 20))
-
-    for i, (loc, hourly_structure) in enumerate(hourly_structures.items()):
-        ax[i].bar(hourly_structure.index, hourly_structure.values)
-        ax[i].set_title(f'Hourly Traffic Structure - {loc}')
-        ax[i].set_xlabel('Hour')
-        ax[i].set_ylabel('Percentage of Signals')  # Keep the ylabel as Percentage of Signals
-
-    plt.tight_layout()
-    plt.savefig(output_jpg)  # Save to jpg file
-    plt.close()  # Close the plot window
+    """
+    Plot hourly structures for all locations as one heatmap, see process_and_plot_traffic_data.
+
+    One image holds every location, so the plot costs the same for any number of locations.
+    Locations without signals are left blank.
+    """
+    location_names, percentages = hourly_structures
+    fig, ax = plt.subplots(figsize=(10, max(4, 0.25 * len(location_names))))
+
+    image = ax.imshow(percentages, aspect='auto', cmap='viridis')
+    ax.set_title('Hourly Traffic Structure')
+    ax.set_xlabel('Hour')
+    ax.set_xticks(np.arange(24))
+    ax.set_yticks(np.arange(len(location_names)))
+    ax.set_yticklabels(location_names)
+    fig.colorbar(image, ax=ax, label='Percentage of Signals')
+
+    fig.tight_layout()
+    fig.savefig(output_jpg, dpi=100, pil_kwargs={'quality': 85})  # Save to jpg file
+    plt.close(fig)  # Close the plot window
 
 def print_hourly_structures(hourly_structures):
-    """Print hourly structures for each location."""
-    for loc, hourly_structure in hourly_structures.items():
+    """Print hourly structures for each location, see process_and_plot_traffic_data."""
+    location_names, percentages = hourly_structures
+    for loc, hourly_structure in zip(location_names, percentages):
         print(f"Hourly Traffic Structure - {loc}:")
-        for hour, percentage in hourly_structure.items():
-            print(f"Hour {hour}: {percentage:.2f}%")
+        # Locations without signals have no structure to print
+        if not np.isnan(hourly_structure).any():
+            for hour, percentage in enumerate(hourly_structure):
+                print(f"Hour {hour}: {percentage:.2f}%")
         print()
 
 def process_and_plot_traffic_data(traffic, locations, output_jpg='hourly_structures.jpg', plot=True):
-    """Process traffic data and plot/print hourly structures for each location."""
+    """
+    Process traffic data and plot/print hourly structures for each location.
+
+    traffic is a DataFrame or an iterable of DataFrame chunks, e.g. from iter_traffic_csv. Chunks
+    are matched and counted one at a time, so only one chunk of signals is held in memory.
+    """
     # Convert column names to lowercase
-    traffic.columns = traffic.columns.str.lower()
     locations.columns = locations.columns.str.lower()
+    logger.debug("Locations columns: %s", locations.columns)
 
-    # Print the columns to debug
-    print("Traffic columns:", traffic.columns)
-    print("Locations columns:", locations.columns)
+    # The locations are indexed and their names factorized once for all chunks; the signals only
+    # carry int location codes, names are used for display
+    tree = build_locations_tree(locations)
+    name_codes, location_names = pd.factorize(locations['location'].to_numpy(dtype=object))
+    counts = np.zeros((len(location_names), 24), dtype=np.int64)
 
-    # Convert 'occured_at' to datetime
-    traffic['occured_at'] = pd.to_datetime(traffic['occured_at'], errors='coerce')
+    chunks = [traffic] if isinstance(traffic, pd.DataFrame) else traffic
+    for chunk in chunks:
+        chunk.columns = chunk.columns.str.lower()
+        logger.debug("Traffic columns: %s", chunk.columns)
 
-    # Match traffic data to locations
-    traffic_with_locations = match_traffic_to_location(traffic, locations)
+        # Convert 'occured_at' to datetime, unless it was already parsed (Parquet, cleansing or the CSV reader)
+        if not pd.api.types.is_datetime64_any_dtype(chunk['occured_at']):
+            chunk['occured_at'] = pd.to_datetime(chunk['occured_at'], errors='coerce')
+
+        # Match traffic data to locations; the hour is extracted once, as a single byte per signal
+        location_codes, _ = nearest_location_codes(chunk['latitude'].to_numpy(), chunk['longitude'].to_numpy(),
+                                                   tree, name_codes)
+        counts += hour_counts(location_codes, signal_hours(chunk['occured_at']), len(location_names))
 
     # Calculate hourly structures
-    hourly_structures = {loc: calculate_hourly_structure(loc, traffic_with_locations) for loc in locations['location']}
+    hourly_structures = location_names, hourly_percentages(counts)
 
     if plot:
         # Plot hourly structures and save to jpg
@@ -72,13 +157,43 @@ def process_and_plot_traffic_data(traffic, locations, output_jpg='hourly_structu
         # Print hourly structures
         print_hourly_structures(hourly_structures)
 
+# Columns used by the hourly structure, in lower case
+TRAFFIC_COLUMNS = ['longitude', 'latitude', 'occured_at']
+LOCATION_COLUMNS = ['location', 'lat', 'lng']
+
+def traffic_csv_columns(traffic_csv_path):
+    """Map the lower-case TRAFFIC_COLUMNS to their spelling in the header of a CSV file."""
+    # Only the header is read
+    header = pd.read_csv(traffic_csv_path, nrows=0).columns
+    return {column.lower(): column for column in header if column.lower() in TRAFFIC_COLUMNS}
+
+def iter_traffic_csv(traffic_csv_path):
+    """
+    Yield the traffic columns of a CSV file in chunks, as read by the pyarrow streaming reader.
+
+    The columns are found whatever their case and parsed by the multi-threaded pyarrow reader;
+    coordinates are read as float32. 'occured_at' is read as text so that every chunk has the
+    same column types; it is parsed per chunk.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    columns = traffic_csv_columns(traffic_csv_path)
+    column_types = {columns[name]: pa.float32() for name in ('latitude', 'longitude') if name in columns}
+    if 'occured_at' in columns:
+        column_types[columns['occured_at']] = pa.string()
+
+    convert_options = pa_csv.ConvertOptions(include_columns=list(columns.values()), column_types=column_types)
+    for batch in pa_csv.open_csv(traffic_csv_path, convert_options=convert_options):
+        yield batch.to_pandas()
+
 if __name__ == "__main__":
     # Paths to data files
     traffic_csv_path = 'TRAFFIC.csv'
     locations_parquet_path = 'locations.parquet'
 
     # Load data
-    traffic = pd.read_csv(traffic_csv_path)
-    locations = pd.read_parquet(locations_parquet_path)
+    traffic = iter_traffic_csv(traffic_csv_path)
+    locations = pd.read_parquet(locations_parquet_path, columns=LOCATION_COLUMNS, engine='pyarrow')
 
     process_and_plot_traffic_data(traffic, locations, plot=False)